@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Compares the fast alignment mode with the exact one on the sequences of an input file
+
+Usage: benchmarks/compare_alignment.py input_file [reference_name] [band]
+
+Should be run from the repository root
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library.dnaprocessor import DnaProcessor
+from library.fastalign import compare_alignment_modes
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        print(__doc__.strip())
+        sys.exit(1)
+    reference_name = sys.argv[2] if len(sys.argv) > 2 else "Homo_sapiens_COI"
+    processor = DnaProcessor(output_dir=os.curdir)
+    processor.load_table(sys.argv[1])
+    ref_data = processor.config.references[reference_name].data
+    if len(sys.argv) > 3:
+        result = compare_alignment_modes(
+            processor.sequences, ref_data, band=int(sys.argv[3]))
+    else:
+        result = compare_alignment_modes(processor.sequences, ref_data)
+    for name, value in result.items():
+        print(name, value, sep='\t')
+
+
+if __name__ == "__main__":
+    main()
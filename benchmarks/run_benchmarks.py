@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Times the stages of the processing on synthetic datasets of several sizes
+and checks that the optional code paths write byte-identical outputs.
+
+Each stage is run --repeat times and its fastest time is kept.
+The results are written as a tab-separated table with the columns size, stage, items and seconds.
+With --baseline, they are compared with an earlier results file and the script fails, if a stage became slower than the tolerance
+and by more than --min-difference seconds.
+
+Should be run from the repository root
+"""
+
+import argparse
+import filecmp
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from library.dnaprocessor import DnaProcessor, OUTPUTS
+from library.seq import differences
+from synthetic import generate_dataset
+
+Result = Tuple[int, str, int, float]
+
+
+def timed(results: List[Result], size: int, stage: str, items: int, function: Callable[[], Any],
+          repeat: int = 1, setup: Optional[Callable[[], Any]] = None) -> Any:
+    """
+    Runs function repeat times, calling setup before each run, and records the fastest run.
+
+    Returns the value of the last run
+    """
+    best = float('inf')
+    for _ in range(max(repeat, 1)):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        value = function()
+        best = min(best, time.perf_counter() - start)
+    results.append((size, stage, items, best))
+    return value
+
+
+def benchmark(size: int, groups: int, reference_name: str, seed: int, workdir: str, repeat: int = 3) -> List[Result]:
+    """
+    Times load_table, the alignment, the group combination, the pairwise differences and report for a dataset of size specimens.
+
+    Each stage is run repeat times
+    """
+    results: List[Result] = []
+    infile = os.path.join(workdir, f"dataset_{size}.tab")
+    generate_dataset(infile, size, groups, reference_name, seed)
+    output_dir = tempfile.mkdtemp(dir=workdir)
+    processor = DnaProcessor(output_dir)
+    timed(results, size, "load_table", size,
+          lambda: processor.load_table(infile), repeat)
+    assert processor.table is not None
+    # the last alignment is reused by align, unless it's discarded
+    alignment = timed(results, size, "align", len(processor.sequences),
+                      lambda: processor.align(reference_name), repeat,
+                      setup=lambda: setattr(processor, 'alignment', None))
+    matrix = alignment.matrix.without_insertions()
+    grouping = processor.table.groupby("species")
+    group_names = list(grouping.size().index)
+    combined = timed(results, size, "combine", len(group_names), lambda: matrix.combine(
+        grouping.ngroup().fillna(-1).astype(np.int64).to_numpy(), len(group_names), processor.haplotype_index), repeat)
+    rows = [combined.row(i) for i in range(len(combined))]
+    timed(results, size, "differences", len(rows) ** 2,
+          lambda: [differences(row1, row2) for row1 in rows for row2 in rows], repeat)
+    timed(results, size, "report", len(group_names), lambda: processor.report(
+        combined, group_names, "species", reference_name), repeat)
+    return results
+
+
+def equivalent_options(workdir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the options of DnaProcessor that should not change the outputs
+    """
+    return {
+        "packed": dict(packed=True),
+        "workers": dict(workers=2),
+        "small chunks": dict(load_chunk_size=7),
+        "out of core": dict(out_of_core_dir=tempfile.mkdtemp(dir=workdir)),
+    }
+
+
+def check_equivalence(size: int, groups: int, reference_name: str, seed: int, workdir: str) -> List[str]:
+    """
+    Runs process_files with the default options, with each of equivalent_options and with a saved dataset.
+
+    Returns the descriptions of the output files that differ from the default ones
+    """
+    infile = os.path.join(workdir, f"equivalence_{size}.tab")
+    generate_dataset(infile, size, groups, reference_name, seed)
+
+    def run(options: Dict[str, Any], infile: str = infile) -> str:
+        output_dir = tempfile.mkdtemp(dir=workdir)
+        processor = DnaProcessor(output_dir)
+        for name, value in options.items():
+            setattr(processor, name, value)
+        processor.process_files(infile, reference_name, "species", [])
+        return output_dir
+
+    expected = run({})
+    variants = {name: run(options)
+                for name, options in equivalent_options(workdir).items()}
+    saving = DnaProcessor(workdir)
+    saving.load_table(infile)
+    dataset_file = os.path.join(workdir, "dataset.bin")
+    saving.save_dataset(dataset_file, reference_name)
+    variants["saved dataset"] = run({}, dataset_file)
+
+    mismatches: List[str] = []
+    filenames = [name + ".txt" for name in OUTPUTS]
+    for variant, output_dir in variants.items():
+        _, different, missing = filecmp.cmpfiles(
+            expected, output_dir, filenames, shallow=False)
+        mismatches.extend(
+            f"{variant}: {filename}" for filename in different + missing)
+    return mismatches
+
+
+def write_results(results: List[Result], path: str) -> None:
+    with open(path, mode="w") as file:
+        print("size", "stage", "items", "seconds", sep='\t', file=file)
+        for size, stage, items, seconds in sorted(results):
+            print(size, stage, items, f"{seconds:.6f}", sep='\t', file=file)
+
+
+def read_results(path: str) -> Dict[Tuple[int, str], float]:
+    with open(path) as file:
+        next(file)
+        results = {}
+        for line in file:
+            size, stage, _, seconds = line.rstrip('\n').split('\t')
+            results[int(size), stage] = float(seconds)
+        return results
+
+
+def compare_results(results: List[Result], baseline: Dict[Tuple[int, str], float], tolerance: float, min_difference: float = 0.05) -> List[str]:
+    """
+    Returns the descriptions of the stages that are slower than tolerance times the baseline and by more than min_difference seconds.
+
+    The absolute difference keeps the noise in the timings of fast stages from counting as a regression
+    """
+    regressions = []
+    for size, stage, _, seconds in sorted(results):
+        old_seconds = baseline.get((size, stage))
+        if old_seconds is None:
+            continue
+        ratio = seconds / old_seconds if old_seconds else float('inf')
+        print(f"{size}\t{stage}\t{old_seconds:.6f}\t{seconds:.6f}\t{ratio:.2f}x")
+        if seconds > tolerance * old_seconds and seconds - old_seconds > min_difference:
+            regressions.append(f"{stage} at {size} specimens")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000,100000",
+                        help="comma-separated numbers of specimens")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--reference", default="Homo_sapiens_COI")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_output.txt",
+                        help="file for the results")
+    parser.add_argument("--baseline", help="results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="allowed ratio of the time to the baseline time")
+    parser.add_argument("--min-difference", type=float, default=0.05,
+                        help="slowdowns of at most this many seconds are allowed regardless of the ratio")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs of each stage, the fastest one is recorded")
+    parser.add_argument("--check-size", type=int, default=500,
+                        help="number of specimens for the equivalence check, 0 to skip it")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        failed = False
+        if args.check_size:
+            mismatches = check_equivalence(
+                args.check_size, args.groups, args.reference, args.seed, workdir)
+            for mismatch in mismatches:
+                print("Different output:", mismatch, file=sys.stderr)
+            failed = bool(mismatches)
+        results = []
+        for size in map(int, args.sizes.split(',')):
+            results.extend(benchmark(size, args.groups,
+                                     args.reference, args.seed, workdir, args.repeat))
+        write_results(results, args.output)
+        if args.baseline:
+            regressions = compare_results(
+                results, read_results(args.baseline), args.tolerance, args.min_difference)
+            for regression in regressions:
+                print("Slower:", regression, file=sys.stderr)
+            failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
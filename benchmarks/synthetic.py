@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Generates a synthetic tab-file of sequences by mutating a reference sequence
+
+Usage: benchmarks/synthetic.py output_file [specimens] [groups] [reference_name] [seed] [options]
+
+The rates of the mutations and the number of haplotypes per group are given as options, see --help.
+Should be run from the repository root
+"""
+
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from library.config import default_config
+
+NUCLEOTIDES = np.frombuffer(b"ACGT", dtype=np.uint8)
+AMBIGUITY_CODES = np.frombuffer(b"RYSWKMBDHVN", dtype=np.uint8)
+
+
+def mutate(rng: np.random.Generator, sequence: np.array, mutation_rate: float, indel_rate: float = 0.0, ambiguity_rate: float = 0.0) -> np.array:
+    """
+    Returns the sequence of ASCII bytes with random substitutions, single nucleotide insertions and deletions
+    and ambiguity codes at the given rates per position
+    """
+    sequence = sequence.copy()
+    substituted = rng.random(len(sequence)) < mutation_rate
+    sequence[substituted] = rng.choice(NUCLEOTIDES, substituted.sum())
+    ambiguous = rng.random(len(sequence)) < ambiguity_rate
+    sequence[ambiguous] = rng.choice(AMBIGUITY_CODES, ambiguous.sum())
+    if indel_rate:
+        indels = np.flatnonzero(rng.random(len(sequence)) < indel_rate)
+        deleted = rng.random(len(indels)) < 0.5
+        inserted = indels[~deleted]
+        sequence = np.insert(sequence, inserted, rng.choice(
+            NUCLEOTIDES, len(inserted)))
+        # positions of the deleted nucleotides after the insertions
+        deletions = indels[deleted] + \
+            np.searchsorted(inserted, indels[deleted], side='right')
+        sequence = np.delete(sequence, deletions)
+    return sequence
+
+
+def generate_dataset(path: str, specimens: int, groups: int, reference_name: str = "Homo_sapiens_COI", seed: int = 0,
+                     group_mutation_rate: float = 0.05, mutation_rate: float = 0.005, indel_rate: float = 0.001,
+                     ambiguity_rate: float = 0.001, max_trim: int = 20, haplotypes: Optional[int] = None) -> None:
+    """
+    Writes a tab-file with the columns specimenid, species and sequence.
+
+    Each of the groups has a sequence, which is the reference with substitutions at group_mutation_rate.
+    The sequences of the specimens have additional substitutions, indels and ambiguity codes at the given rates,
+    and up to max_trim nucleotides are removed from each end.
+    The specimens are assigned to the groups at random.
+
+    If haplotypes is given, each group has only that many distinct sequences, which are shared by its specimens.
+
+    The same arguments always produce the same file
+    """
+    rng = np.random.default_rng(seed)
+    reference = np.frombuffer(
+        str(default_config().references[reference_name]).encode('ascii'), dtype=np.uint8)
+    group_sequences = [mutate(rng, reference, group_mutation_rate)
+                       for _ in range(groups)]
+    specimen_groups = rng.integers(0, groups, specimens)
+    pools: Optional[List[List[np.array]]] = [[] for _ in range(groups)] if haplotypes else None
+    with open(path, mode="w") as file:
+        print("specimenid", "species", "sequence", sep='\t', file=file)
+        for i, group in enumerate(specimen_groups.tolist()):
+            if pools is not None and haplotypes and len(pools[group]) >= haplotypes:
+                sequence = pools[group][int(rng.integers(0, haplotypes))]
+            else:
+                sequence = mutate(
+                    rng, group_sequences[group], mutation_rate, indel_rate, ambiguity_rate)
+                start, end = rng.integers(0, max_trim + 1, 2)
+                sequence = sequence[start:len(sequence) - end]
+                if pools is not None:
+                    pools[group].append(sequence)
+            print(f"specimen_{i}", f"species_{group}",
+                  sequence.tobytes().decode('ascii'), sep='\t', file=file)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_file")
+    parser.add_argument("specimens", type=int, nargs='?', default=1000)
+    parser.add_argument("groups", type=int, nargs='?', default=10)
+    parser.add_argument("reference_name", nargs='?', default="Homo_sapiens_COI")
+    parser.add_argument("seed", type=int, nargs='?', default=0)
+    parser.add_argument("--group-mutation-rate", type=float, default=0.05,
+                        help="rate of the substitutions in the sequence of each group")
+    parser.add_argument("--mutation-rate", type=float, default=0.005,
+                        help="rate of the additional substitutions in the sequence of each specimen")
+    parser.add_argument("--indel-rate", type=float, default=0.001,
+                        help="rate of the single nucleotide insertions and deletions")
+    parser.add_argument("--ambiguity-rate", type=float, default=0.001,
+                        help="rate of the ambiguity codes")
+    parser.add_argument("--max-trim", type=int, default=20,
+                        help="maximal number of nucleotides removed from each end")
+    parser.add_argument("--haplotypes", type=int,
+                        help="number of distinct sequences in each group, all sequences are distinct if not given")
+    args = parser.parse_args()
+    generate_dataset(args.output_file, args.specimens, args.groups, args.reference_name, args.seed,
+                     group_mutation_rate=args.group_mutation_rate, mutation_rate=args.mutation_rate,
+                     indel_rate=args.indel_rate, ambiguity_rate=args.ambiguity_rate, max_trim=args.max_trim,
+                     haplotypes=args.haplotypes)
+
+
+if __name__ == "__main__":
+    main()
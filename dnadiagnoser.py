@@ -1,15 +1,17 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import tempfile
 
-
-from library.gui_utils import *
-from library.dnaprocessor import DnaProcessor
-from library.gui import DNADiagnoserGUI
+from library import cli
 
 
 def launch_gui() -> None:
+    # the command line doesn't need Tk
+    import tkinter as tk
+    from library.gui import DNADiagnoserGUI
+
     root = tk.Tk()
 
     def close_window():
@@ -33,15 +35,8 @@ def launch_gui() -> None:
 
 
 def main() -> None:
-    if len(sys.argv) >= 3:
-        input = sys.argv[1]
-        try:
-            reference_name = sys.argv[3]
-        except IndexError:
-            reference_name = "Homo_sapiens_COI"
-        output_dir = tempfile.mkdtemp()
-        processor = DnaProcessor(output_dir)
-        processor.process_files(input, reference_name, "species", [])
+    if len(sys.argv) > 1:
+        sys.exit(cli.main(sys.argv[1:]))
     else:
         launch_gui()
 
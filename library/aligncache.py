@@ -0,0 +1,99 @@
+import hashlib
+import sqlite3
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from library.config import Config, default_config
+
+
+class AlignmentCache:
+    """
+    Persistent cache of alignments in a SQLite database
+
+    An entry is keyed by a hash of the encoded sequence, the reference name and data, the scores from data/scores.tab
+    and the alignment method.
+    It stores the alignment coordinates, from which the aligned data, insertions, start and end are reconstructed,
+    and, if store_displays is set, the formatted alignment.
+
+    When there are more than max_entries entries, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000000, store_displays: bool = False) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.store_displays = store_displays
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS alignments (key BLOB PRIMARY KEY, coordinates BLOB NOT NULL, display BLOB, used INTEGER NOT NULL)")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS alignments_used ON alignments (used)")
+        self.connection.commit()
+        self.clock = self.connection.execute(
+            "SELECT COALESCE(MAX(used), 0) FROM alignments").fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'AlignmentCache':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    @staticmethod
+    def reference_key(reference_name: str, ref_data: np.array, method: str = "exact", config: Optional[Config] = None) -> bytes:
+        """
+        Returns the part of the keys that depends on the reference, the scores of config or default_config() and the alignment method
+        """
+        hasher = hashlib.sha256()
+        hasher.update(method.encode('utf-8'))
+        hasher.update(b'\0')
+        hasher.update(reference_name.encode('utf-8'))
+        hasher.update(b'\0')
+        hasher.update(ref_data.tobytes())
+        for score_name, val in sorted((config or default_config()).scores.items()):
+            hasher.update(f"\0{score_name}\t{val}".encode('utf-8'))
+        return hasher.digest()
+
+    @staticmethod
+    def key(reference_key: bytes, data: np.array) -> bytes:
+        return hashlib.sha256(reference_key + data.tobytes()).digest()
+
+    def get(self, keys: List[bytes]) -> Dict[bytes, Tuple[np.array, Optional[str]]]:
+        """
+        Returns the coordinates and displays of the cached keys
+        """
+        result = {}
+        self.clock += 1
+        with self.connection:
+            for key in keys:
+                row = self.connection.execute(
+                    "SELECT coordinates, display FROM alignments WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    continue
+                coordinates, display = row
+                result[key] = (np.frombuffer(coordinates, dtype=np.int64).reshape(2, -1),
+                               zlib.decompress(display).decode('ascii') if display is not None else None)
+                self.connection.execute(
+                    "UPDATE alignments SET used = ? WHERE key = ?", (self.clock, key))
+        return result
+
+    def put(self, entries: Iterable[Tuple[bytes, np.array, Optional[str]]]) -> None:
+        """
+        Stores the (key, coordinates, display) entries and evicts the least recently used entries above max_entries
+
+        The displays are stored only if store_displays is set
+        """
+        self.clock += 1
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO alignments VALUES (?, ?, ?, ?)", (
+                (key, np.ascontiguousarray(coordinates, dtype=np.int64).tobytes(),
+                 zlib.compress(display.encode('ascii')) if self.store_displays and display is not None else None, self.clock)
+                for key, coordinates, display in entries))
+            size = self.connection.execute(
+                "SELECT COUNT(*) FROM alignments").fetchone()[0]
+            if size > self.max_entries:
+                self.connection.execute("DELETE FROM alignments WHERE key IN (SELECT key FROM alignments ORDER BY used LIMIT ?)",
+                                        (size - self.max_entries,))
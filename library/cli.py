@@ -0,0 +1,254 @@
+import argparse
+import os
+import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from library.dnaprocessor import DnaProcessor, OUTPUTS, AUTO_REFERENCE
+from library.aligncache import AlignmentCache
+from library.loader import DEFAULT_FASTA_HEADER
+from library.config import default_config
+from library.refindex import MIN_REFERENCE_SCORE
+
+
+class Job(NamedTuple):
+    """
+    Processing of one input file by process_job
+    """
+    infile: str
+    output_dir: str
+    reference_name: str
+    column: str
+    selection: List[str]
+    # attributes of DnaProcessor
+    options: Dict[str, Any]
+    # path of the AlignmentCache database
+    cache: Optional[str]
+    quiet: bool
+
+
+def stage_printer(name: str) -> Callable[[str, int, int], None]:
+    """
+    Returns the progress callback that prints each new stage of the processing of the file to stderr
+    """
+    def print_stage(stage: str, done: int, total: int) -> None:
+        if not done:
+            print(f"{name}: {stage}...", file=sys.stderr)
+    return print_stage
+
+
+def process_job(job: Job) -> List[str]:
+    """
+    Writes the outputs for the input file of the job.
+
+    Returns the messages of the warnings
+    """
+    os.makedirs(job.output_dir, exist_ok=True)
+    processor = DnaProcessor(job.output_dir)
+    for name, value in job.options.items():
+        setattr(processor, name, value)
+    if not job.quiet:
+        processor.progress_callbacks.append(
+            stage_printer(os.path.basename(job.infile)))
+    with warnings.catch_warnings(record=True) as warns:
+        if job.cache:
+            processor.alignment_cache = AlignmentCache(job.cache)
+        try:
+            processor.process_files(
+                job.infile, job.reference_name, job.column, job.selection, keep_selection=True)
+        finally:
+            if processor.alignment_cache is not None:
+                processor.alignment_cache.close()
+    return [str(w.message) for w in warns]
+
+
+def read_manifest(path: str) -> List[Sequence[str]]:
+    """
+    Reads the lines of the manifest, each line is an input file, optionally followed by a tab and an output directory.
+
+    Empty lines and lines starting with '#' are skipped. Relative paths are relative to the manifest
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    entries: List[Sequence[str]] = []
+    with open(path) as file:
+        for line in file:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            entries.append([os.path.join(base, field)
+                            for field in line.split('\t')[:2]])
+    return entries
+
+
+def parse_outputs(value: str) -> List[str]:
+    outputs = [name for name in value.split(',') if name]
+    unknown = set(outputs) - set(OUTPUTS)
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"unknown outputs: {', '.join(sorted(unknown))}. The outputs are: {', '.join(OUTPUTS)}")
+    return outputs
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="dnadiagnoser", description="Identifies diagnostic DNA nucleotides. Without arguments, the GUI is started")
+    parser.add_argument("inputs", nargs="*", help="input files")
+    parser.add_argument("--manifest", help="file with an input file on each line, "
+                        "optionally followed by a tab and its output directory")
+    parser.add_argument("-o", "--output-dir", default="output",
+                        help="directory for the outputs, with several input files each gets a subdirectory named after it")
+    parser.add_argument("-r", "--reference", default="Homo_sapiens_COI",
+                        help=f"name of the reference sequence in data/reference_sequences.tab or '{AUTO_REFERENCE}' "
+                        "to use the one closest to the sequences of each file")
+    parser.add_argument("--min-reference-score", type=float, default=MIN_REFERENCE_SCORE,
+                        help=f"with '-r {AUTO_REFERENCE}', the minimal fraction of k-mers shared with the reference, below it the file fails")
+    parser.add_argument("-c", "--column", default="species",
+                        help="column, whose values are compared")
+    parser.add_argument("-s", "--select", action="append", default=[], metavar="VALUE",
+                        help="value of the column to compare, can be repeated. All values are compared by default")
+    parser.add_argument("--outputs", type=parse_outputs, default=list(OUTPUTS),
+                        help=f"comma-separated outputs to write, from {', '.join(OUTPUTS)}")
+    parser.add_argument("--aligned", action="store_true",
+                        help="the sequences are already aligned")
+    parser.add_argument("--insertions", action="store_true",
+                        help="use insertions/deletions as diagnostic sites")
+    parser.add_argument("--relative-positions", action="store_true",
+                        help="print positions relative to the reference sequence")
+    parser.add_argument("--position-group",
+                        help="value of the column, whose sequence is used for the relative positions")
+    parser.add_argument("--packed", action="store_true",
+                        help="store two nucleotides per byte")
+    parser.add_argument("--fast", action="store_true",
+                        help="seeded alignment for sequences close to the reference")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes for the alignment of each file")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of input files processed at the same time")
+    parser.add_argument("--cache", help="SQLite database for caching the alignments")
+    parser.add_argument("--out-of-core", metavar="DIR",
+                        help="keep the aligned sequences in memory-mapped files in DIR")
+    parser.add_argument("--chunk-size", type=int, default=10000,
+                        help="number of rows of the input file that are read at once")
+    parser.add_argument("--fasta-header", default=DEFAULT_FASTA_HEADER,
+                        help="regular expression, whose named groups are the columns parsed from FASTA headers")
+    parser.add_argument("--no-alignments", action="store_true",
+                        help="don't write Aligments.txt")
+    parser.add_argument("--profile", action="store_true",
+                        help="write run_profile.json next to the outputs")
+    parser.add_argument("--detailed-profile", action="store_true",
+                        help="also profile with cProfile and tracemalloc")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="don't print the stages of the processing")
+    return parser
+
+
+def make_jobs(args: argparse.Namespace) -> List[Job]:
+    entries: List[Sequence[str]] = [[infile] for infile in args.inputs]
+    if args.manifest:
+        entries.extend(read_manifest(args.manifest))
+    if not entries:
+        raise ValueError("No input files are given")
+    references = default_config().references
+    if args.reference != AUTO_REFERENCE and args.reference not in references:
+        raise ValueError(
+            f"Unknown reference sequence {args.reference}. The reference sequences are: {', '.join(references)}")
+    outputs = set(args.outputs)
+    if args.no_alignments:
+        outputs.discard("Aligments")
+    options = dict(
+        aligned=args.aligned,
+        insertions=args.insertions,
+        relative_positions=args.relative_positions,
+        position_group=args.position_group,
+        packed=args.packed,
+        fast_alignment=args.fast,
+        workers=args.workers,
+        out_of_core_dir=args.out_of_core,
+        load_chunk_size=args.chunk_size,
+        fasta_header_pattern=args.fasta_header,
+        outputs=outputs,
+        write_profile=args.profile or args.detailed_profile,
+        detailed_profile=args.detailed_profile,
+        min_reference_score=args.min_reference_score,
+    )
+    jobs = []
+    output_dirs = set()
+    for entry in entries:
+        infile = entry[0]
+        if len(entry) > 1:
+            output_dir = entry[1]
+        elif len(entries) == 1:
+            output_dir = args.output_dir
+        else:
+            name, _ = os.path.splitext(os.path.basename(infile))
+            output_dir = os.path.join(args.output_dir, name)
+        if output_dir in output_dirs:
+            raise ValueError(
+                f"Several input files have the output directory {output_dir}")
+        output_dirs.add(output_dir)
+        jobs.append(Job(infile, output_dir, args.reference, args.column,
+                        args.select, options, args.cache, args.quiet))
+    return jobs
+
+
+def legacy_arguments(argv: List[str]) -> Optional[List[str]]:
+    """
+    Returns the options equivalent to the old form `input column [reference]` of the arguments,
+    None if argv is not in this form.
+
+    The arguments are in the old form, if there are two or three of them, none is an option
+    and only the first one is an existing file
+    """
+    if len(argv) not in (2, 3) or any(arg.startswith('-') for arg in argv):
+        return None
+    if not os.path.isfile(argv[0]) or any(os.path.exists(arg) for arg in argv[1:]):
+        return None
+    infile, column, *reference = argv
+    return [infile, "-c", column] + (["-r", reference[0]] if reference else [])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Processes the input files given on the command line.
+
+    Returns the exit status, which is 1 if any file failed
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    legacy = legacy_arguments(argv)
+    if legacy is not None:
+        print("Warning: the arguments `input column reference` are deprecated, use: dnadiagnoser.py " +
+              " ".join(legacy), file=sys.stderr)
+        argv = legacy
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    try:
+        jobs = make_jobs(args)
+    except ValueError as ex:
+        parser.error(str(ex))
+    failed = False
+
+    def report(job: Job, messages: List[str]) -> None:
+        for message in messages:
+            print(f"{job.infile}: Warning: {message}", file=sys.stderr)
+        if not args.quiet:
+            print(f"{job.infile}: the outputs are in {job.output_dir}", file=sys.stderr)
+
+    if args.jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(process_job, job) for job in jobs]
+            for job, future in zip(jobs, futures):
+                try:
+                    report(job, future.result())
+                except Exception as ex:
+                    print(f"{job.infile}: Error: {ex}", file=sys.stderr)
+                    failed = True
+    else:
+        for job in jobs:
+            try:
+                report(job, process_job(job))
+            except Exception as ex:
+                print(f"{job.infile}: Error: {ex}", file=sys.stderr)
+                failed = True
+    return 1 if failed else 0
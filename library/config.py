@@ -0,0 +1,134 @@
+import itertools
+import os
+from functools import lru_cache
+from typing import Any, Dict, Optional, TYPE_CHECKING
+
+import numpy as np
+from Bio.Align import PairwiseAligner
+
+if TYPE_CHECKING:
+    from library.seq import Seq
+    from library.refindex import ReferencePanelIndex
+
+# directory of the data files, independent of the working directory
+DATA_DIR = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'data')
+
+SCORE_NAMES = ('gap penalty', 'gap extend penalty', 'end gap penalty',
+               'end gap extend penalty', 'match score', 'mismatch score')
+
+
+class Config:
+    """
+    Alignment scores and reference sequences, which are read from the data files on first use
+
+    The score matrix, the aligner and the k-mer index of the references are built on first use.
+    When pickled, for example for worker processes, only the paths and the values read so far are sent,
+    the aligner and the index are rebuilt by the receiver.
+    """
+
+    def __init__(self, scores_path: Optional[str] = None, references_path: Optional[str] = None) -> None:
+        self.scores_path = scores_path or os.path.join(DATA_DIR, 'scores.tab')
+        self.references_path = references_path or os.path.join(
+            DATA_DIR, 'reference_sequences.tab')
+        self._scores: Optional[Dict[str, int]] = None
+        self._references: Optional[Dict[str, 'Seq']] = None
+        self._score_matrix: Optional[np.array] = None
+        self._aligner: Optional[PairwiseAligner] = None
+        self._reference_index: Optional['ReferencePanelIndex'] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state['_score_matrix'] = None
+        state['_aligner'] = None
+        state['_reference_index'] = None
+        return state
+
+    @property
+    def scores(self) -> Dict[str, int]:
+        if self._scores is None:
+            scores = {}
+            with open(self.scores_path) as scores_file:
+                for line in scores_file:
+                    score_name, _, val = line.partition('\t')
+                    try:
+                        scores[score_name] = int(val)
+                    except ValueError as ex:
+                        raise ValueError(
+                            f"The value for '{score_name}' in {self.scores_path} is not a number") from ex
+            for score_name in SCORE_NAMES:
+                if score_name not in scores:
+                    raise ValueError(
+                        f"'{score_name}' is missing in {self.scores_path}")
+            self._scores = scores
+        return self._scores
+
+    @property
+    def gap_penalty(self) -> int:
+        return self.scores['gap penalty']
+
+    @property
+    def gap_extend_penalty(self) -> int:
+        return self.scores['gap extend penalty']
+
+    @property
+    def end_gap_penalty(self) -> int:
+        return self.scores['end gap penalty']
+
+    @property
+    def end_gap_extend_penalty(self) -> int:
+        return self.scores['end gap extend penalty']
+
+    @property
+    def score_matrix(self) -> np.array:
+        """
+        Scores of the pairs of encoded nucleotides, nucleotides match if their codes share a bit
+        """
+        if self._score_matrix is None:
+            score_matrix = np.empty((16, 16))
+            for i, j in itertools.product(range(0, 16), range(0, 16)):
+                score_matrix[i, j] = self.scores['match score'] if i & j else self.scores['mismatch score']
+            self._score_matrix = score_matrix
+        return self._score_matrix
+
+    @property
+    def aligner(self) -> PairwiseAligner:
+        if self._aligner is None:
+            self._aligner = PairwiseAligner(substitution_matrix=self.score_matrix, end_open_gap_score=self.end_gap_penalty,
+                                            end_extend_gap_score=self.end_gap_extend_penalty, internal_open_gap_score=self.gap_penalty,
+                                            internal_extend_gap_score=self.gap_extend_penalty)
+        return self._aligner
+
+    @property
+    def references(self) -> Dict[str, 'Seq']:
+        """
+        Encoded reference sequences by name
+        """
+        if self._references is None:
+            from library.seq import Seq
+            references = {}
+            with open(self.references_path) as file:
+                for line in file:
+                    name, _, sequence = line.partition('\t')
+                    if name and sequence:
+                        references[name] = Seq.from_str(sequence)
+            self._references = references
+        return self._references
+
+    @property
+    def reference_index(self) -> 'ReferencePanelIndex':
+        """
+        Index of the k-mers of the references for detecting the closest one
+        """
+        if self._reference_index is None:
+            from library.refindex import ReferencePanelIndex
+            self._reference_index = ReferencePanelIndex(self.references)
+        return self._reference_index
+
+
+@lru_cache(maxsize=None)
+def default_config() -> Config:
+    """
+    Returns the shared configuration with the data files of the package
+    """
+    return Config()
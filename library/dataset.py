@@ -0,0 +1,200 @@
+import json
+import struct
+import warnings
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+import numpy as np
+
+from library.seq import SEQ_DTYPE
+from library.seqmatrix import SequenceMatrix, AlignmentDisplays, ReferenceAlignment
+from library.aligncache import AlignmentCache
+from library.config import Config
+
+# the first bytes of a dataset file
+MAGIC = b"DNADIAG\0"
+
+DATASET_VERSION = 1
+
+# the magic, the version and the length of the header
+PREAMBLE = struct.Struct("<8sIQ")
+
+# the arrays start at multiples of ALIGNMENT bytes
+ALIGNMENT = 64
+
+
+class Dataset:
+    """
+    Loaded input file
+
+    table contains the metadata columns and haplotype_index contains the haplotype of each row.
+    The haplotypes are either unaligned in sequences, or, if the input file is already aligned, in matrix.
+    alignment is the alignment of sequences with a reference, if there is one.
+    """
+
+    def __init__(self, table: pd.DataFrame, haplotype_index: np.array, sequences: Sequence[np.array], matrix: Optional[SequenceMatrix] = None, alignment: Optional[ReferenceAlignment] = None) -> None:
+        self.table = table
+        self.haplotype_index = haplotype_index
+        self.sequences = sequences
+        self.matrix = matrix
+        self.alignment = alignment
+
+    @property
+    def aligned(self) -> bool:
+        return self.matrix is not None
+
+
+def is_dataset(infile: str) -> bool:
+    with open(infile, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def _concatenate(arrays: Sequence[np.array], dtype: Any, axis: int = 0) -> Tuple[np.array, np.array]:
+    """
+    Returns the concatenated arrays and the offsets of each array along axis
+    """
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([array.shape[axis] for array in arrays], out=offsets[1:])
+    if not arrays:
+        shape = (0,) if axis == 0 else (2, 0)
+        return np.zeros(shape, dtype=dtype), offsets
+    return np.concatenate(arrays, axis=axis).astype(dtype, copy=False), offsets
+
+
+def _split(data: np.array, offsets: np.array, axis: int = 0) -> List[np.array]:
+    """
+    Inverse of _concatenate, the parts are views into data
+    """
+    bounds = offsets.tolist()
+    if axis == 0:
+        return [data[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    else:
+        return [data[:, start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _matrix_arrays(matrix: SequenceMatrix, prefix: str) -> Dict[str, np.array]:
+    rows = sorted(matrix.insertions)
+    positions = [position for row in rows for position in matrix.insertions[row]]
+    insertion_data, insertion_offsets = _concatenate(
+        [matrix.insertions[row][position] for row in rows for position in matrix.insertions[row]], SEQ_DTYPE)
+    return {
+        prefix + 'data': matrix.data,
+        prefix + 'starts': matrix.starts,
+        prefix + 'ends': matrix.ends,
+        prefix + 'insertion_rows': np.array([row for row in rows for _ in matrix.insertions[row]], dtype=np.int64),
+        prefix + 'insertion_positions': np.array(positions, dtype=np.int64),
+        prefix + 'insertion_data': insertion_data,
+        prefix + 'insertion_offsets': insertion_offsets,
+    }
+
+
+def _matrix_from_arrays(arrays: Dict[str, np.array], prefix: str, width: int, packed: bool) -> SequenceMatrix:
+    insertions: Dict[int, Dict[int, np.array]] = {}
+    for row, position, data in zip(arrays[prefix + 'insertion_rows'].tolist(), arrays[prefix + 'insertion_positions'].tolist(),
+                                   _split(arrays[prefix + 'insertion_data'], arrays[prefix + 'insertion_offsets'])):
+        insertions.setdefault(row, {})[position] = data
+    return SequenceMatrix(arrays[prefix + 'data'], arrays[prefix + 'starts'], arrays[prefix + 'ends'], insertions, width, packed)
+
+
+def _table_to_json(table: pd.DataFrame) -> Dict[str, Any]:
+    return dict(
+        index_name=table.index.name,
+        index=table.index.tolist(),
+        columns={str(column): table[column].tolist() for column in table.columns})
+
+
+def _table_from_json(description: Dict[str, Any]) -> pd.DataFrame:
+    return pd.DataFrame(description['columns'], index=pd.Index(description['index'], name=description['index_name']))
+
+
+def write_dataset(path: str, dataset: Dataset) -> None:
+    """
+    Writes the dataset into a binary file, which can be read back with read_dataset.
+
+    The file consists of a preamble, a JSON header with the metadata table and the description of the arrays,
+    and the raw arrays, each starting at a multiple of ALIGNMENT bytes, so that they can be memory-mapped.
+    """
+    arrays: Dict[str, np.array] = dict(haplotype_index=dataset.haplotype_index)
+    arrays['sequence_data'], arrays['sequence_offsets'] = _concatenate(
+        dataset.sequences, SEQ_DTYPE)
+    header: Dict[str, Any] = dict(table=_table_to_json(dataset.table))
+    if dataset.matrix is not None:
+        arrays.update(_matrix_arrays(dataset.matrix, 'matrix_'))
+        header['matrix'] = dict(
+            width=dataset.matrix.width, packed=dataset.matrix.packed)
+    if dataset.alignment is not None:
+        alignment = dataset.alignment
+        arrays.update(_matrix_arrays(alignment.matrix, 'alignment_'))
+        arrays['coordinate_data'], arrays['coordinate_offsets'] = _concatenate(
+            list(alignment.displays.coordinates), np.int64, axis=1)
+        header['alignment'] = dict(
+            reference_name=alignment.reference_name,
+            method=alignment.method,
+            reference_key=alignment.reference_key.hex(),
+            width=alignment.matrix.width,
+            packed=alignment.matrix.packed)
+    offset = 0
+    descriptions = {}
+    for name, array in arrays.items():
+        descriptions[name] = dict(
+            dtype=array.dtype.str, shape=list(array.shape), offset=offset)
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header['arrays'] = descriptions
+    header_bytes = json.dumps(header, default=str).encode('utf-8')
+    data_start = -(-(PREAMBLE.size + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+    with open(path, 'wb') as file:
+        file.write(PREAMBLE.pack(MAGIC, DATASET_VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        for name, array in arrays.items():
+            file.seek(data_start + descriptions[name]['offset'])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(data_start + offset)
+
+
+def read_dataset(path: str, config: Config) -> Dataset:
+    """
+    Reads a dataset written by write_dataset.
+
+    The arrays are read-only memory maps of the file.
+    The saved alignment is dropped with a warning, if its reference sequence or the scores have changed in config.
+    """
+    with open(path, 'rb') as file:
+        preamble = file.read(PREAMBLE.size)
+        if len(preamble) < PREAMBLE.size:
+            raise ValueError(f"{path} is not a dataset file")
+        magic, version, header_length = PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a dataset file")
+        if version != DATASET_VERSION:
+            raise ValueError(
+                f"{path} has the dataset format version {version}, but only version {DATASET_VERSION} is supported")
+        header = json.loads(file.read(header_length).decode('utf-8'))
+    data_start = -(-(PREAMBLE.size + header_length) // ALIGNMENT) * ALIGNMENT
+    arrays = {}
+    for name, description in header['arrays'].items():
+        shape = tuple(description['shape'])
+        if np.prod(shape, dtype=np.int64) == 0:
+            arrays[name] = np.zeros(shape, dtype=description['dtype'])
+        else:
+            arrays[name] = np.memmap(path, dtype=description['dtype'], mode='r',
+                                     offset=data_start + description['offset'], shape=shape)
+    sequences = _split(arrays['sequence_data'], arrays['sequence_offsets'])
+    matrix = None
+    if 'matrix' in header:
+        matrix = _matrix_from_arrays(
+            arrays, 'matrix_', header['matrix']['width'], header['matrix']['packed'])
+    alignment = None
+    if 'alignment' in header:
+        description = header['alignment']
+        reference_name = description['reference_name']
+        reference = config.references.get(reference_name)
+        if reference is None or AlignmentCache.reference_key(reference_name, reference.data, description['method'], config).hex() != description['reference_key']:
+            warnings.warn(
+                f"The alignment in {path} was made with a different {reference_name} reference sequence or scores and is not used")
+        else:
+            alignment = ReferenceAlignment(reference_name, description['method'],
+                                           _matrix_from_arrays(
+                                               arrays, 'alignment_', description['width'], description['packed']),
+                                           AlignmentDisplays(sequences, reference.data, _split(arrays['coordinate_data'], arrays['coordinate_offsets'], axis=1)),
+                                           config)
+    return Dataset(_table_from_json(header['table']), arrays['haplotype_index'], sequences, matrix, alignment)
@@ -0,0 +1,107 @@
+from typing import Dict, List, TextIO
+
+import numpy as np
+
+from library.seq import SEQ_DTYPE
+from library.seqmatrix import SequenceMatrix
+
+# mismatch_table[nuc1, nuc2] is 1, if differences() reports nuc1 and nuc2 as a replacement
+mismatch_table = np.array([[1.0 if not nuc1 & nuc2 and (nuc1 or nuc2) else 0.0 for nuc2 in range(16)]
+                           for nuc1 in range(16)], dtype=np.float32)
+
+# code for the positions outside of the content of a sequence
+OUTSIDE = 16
+
+
+def _masked_codes(groups: SequenceMatrix, rows: slice) -> np.array:
+    """
+    Returns the codes of the rows, with the positions outside of their content replaced by OUTSIDE
+    """
+    codes = groups.codes(rows)
+    positions = np.arange(codes.shape[1])
+    inside = (positions >= groups.starts[rows, np.newaxis]) & (
+        positions < groups.ends[rows, np.newaxis])
+    return np.where(inside, codes, SEQ_DTYPE(OUTSIDE))
+
+
+def _one_hot(codes: np.array, present: np.array) -> np.array:
+    """
+    Returns the float32 array of shape codes.shape + (len(present),) which indicates the code at each position
+    """
+    return (codes[..., np.newaxis] == present).astype(np.float32)
+
+
+def replacement_counts(groups: SequenceMatrix, block_size: int = 128) -> np.array:
+    """
+    Returns the symmetric matrix of the numbers of replaced nucleotides between the groups.
+
+    The rows are one-hot encoded, so that each block of the result is a single matrix product.
+    Only the blocks of the lower triangle are computed, at most two blocks of block_size rows are one-hot encoded at once.
+    """
+    n = len(groups)
+    counts = np.zeros((n, n), dtype=np.int64)
+    if not n:
+        return counts
+    # only the codes that occur in the groups are one-hot encoded
+    occurrences = np.zeros(OUTSIDE + 1, dtype=np.int64)
+    for i in range(0, n, block_size):
+        occurrences += np.bincount(_masked_codes(groups, slice(i, i + block_size)).ravel(), minlength=OUTSIDE + 1)
+    present = np.flatnonzero(occurrences[:OUTSIDE])
+    mismatches = mismatch_table[np.ix_(present, present)]
+    for i in range(0, n, block_size):
+        rows1 = slice(i, min(i + block_size, n))
+        mismatches1 = (_one_hot(_masked_codes(groups, rows1), present) @
+                       mismatches).reshape(rows1.stop - rows1.start, -1)
+        for j in range(0, i + 1, block_size):
+            rows2 = slice(j, min(j + block_size, n))
+            one_hot2 = _one_hot(_masked_codes(groups, rows2), present).reshape(
+                rows2.stop - rows2.start, -1)
+            block = np.rint(mismatches1 @ one_hot2.T).astype(np.int64)
+            counts[rows1, rows2] = block
+            counts[rows2, rows1] = block.T
+    return counts
+
+
+def insertion_counts(groups: SequenceMatrix) -> np.array:
+    """
+    Returns the matrix of the total lengths of the insertions returned by differences().
+
+    For the groups i and j, differences() returns all insertions of i and the insertions of j at the keys without an insertion in i,
+    while the common keys are counted with the length of the insertion in i.
+    """
+    n = len(groups)
+    keys: Dict[int, int] = {}
+    for insertions in groups.insertions.values():
+        for key in insertions:
+            keys.setdefault(key, len(keys))
+    lengths = np.zeros((n, len(keys)), dtype=np.int64)
+    for row, insertions in groups.insertions.items():
+        for key, fragment in insertions.items():
+            lengths[row, keys[key]] = len(fragment)
+    present = (lengths > 0).astype(np.int64)
+    totals = lengths.sum(axis=1)
+    # common[i, j] is the total length of the insertions of i at the keys where j has an insertion
+    common = lengths @ present.T
+    return totals[:, np.newaxis] + totals[np.newaxis, :] - common.T + common
+
+
+def difference_counts(groups: SequenceMatrix, block_size: int = 128) -> np.array:
+    """
+    Returns the matrix of the numbers of differences between the groups.
+
+    The element [i, j] equals the number of differences reported by differences(groups.row(i), groups.row(j))
+    """
+    return replacement_counts(groups, block_size) + insertion_counts(groups)
+
+
+def write_difference_matrix(counts: np.array, group_names: List[str], output: TextIO) -> None:
+    """
+    Writes the lower triangle of counts
+    """
+    print("", *group_names, sep='\t', file=output)
+    for i, species1 in enumerate(group_names):
+        output.write(species1)
+        for j, species2 in enumerate(group_names):
+            if species1 >= species2:
+                output.write(f"\t{counts[i, j]}")
+        output.write("\n")
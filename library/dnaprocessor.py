@@ -1,31 +1,19 @@
 import os
-import io
-import tkinter as tk
-from typing import Dict, List, Optional, TextIO, Callable, Tuple
-import warnings
-from functools import reduce
+from contextlib import nullcontext
+from typing import Any, ContextManager, Dict, List, Optional, TextIO, Callable, Tuple, Iterator, Sequence, Set
 
 import pandas as pd
 import numpy as np
 
-from library.seq import Seq, differences, seq_write_tuple
-
-with open(os.path.join('data', 'reference_sequences.tab')) as file:
-    references: Dict[str, Seq] = {}
-    for line in file:
-        name, _, sequence = line.partition('\t')
-        if name and sequence:
-            references[name] = Seq.from_str(sequence)
-
-typos = dict(
-    specimen_voucher='specimenid',
-    specimen_id='specimenid',
-    sequences='sequence'
-)
-
-
-def combine_sequences(series: pd.Series) -> Seq:
-    return reduce(Seq.__or__, series)
+from library.seq import Seq, Replacements, PositionTranslator, differences, decode, seq_write_tuple
+from library.seqmatrix import SequenceMatrix, SequenceDisplays, ReferenceAlignment, align_sequences
+from library.diffmatrix import difference_counts, write_difference_matrix
+from library.aligncache import AlignmentCache
+from library.loader import read_table, DEFAULT_FASTA_HEADER
+from library.dataset import Dataset, is_dataset, read_dataset, write_dataset
+from library.profiling import RunProfile
+from library.config import Config, default_config
+from library.refindex import sample_indices, MIN_REFERENCE_SCORE
 
 
 def and_join(words: List[str]) -> str:
@@ -37,9 +25,24 @@ def and_join(words: List[str]) -> str:
         return ", ".join(words[:-1]) + " and " + words[-1]
 
 
-def show_differences(repl: List[Tuple[int, int, int]], ins1: Dict[int, np.array], ins2: Dict[int, np.array], translation: Callable[[int], str] = str) -> str:
+def file_stamp(path: str) -> Tuple[float, int]:
+    """
+    Returns the modification time and the size of the file
+    """
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def replacement_chars(repl: Replacements) -> Iterator[Tuple[int, str, str]]:
+    """
+    Yields (index, nucleotide1, nucleotide2) of the replacements with nucleotides as characters
+    """
+    return zip(repl.indices.tolist(), decode(repl.nucs1), decode(repl.nucs2))
+
+
+def show_differences(repl: Replacements, ins1: Dict[int, np.array], ins2: Dict[int, np.array], translation: Callable[[int], str] = str) -> str:
     replacements = ", ".join(
-        f"{translation(i)} ({seq_write_tuple[nuc1]} vs. {seq_write_tuple[nuc2]})" for i, nuc1, nuc2 in repl)
+        f"{translation(i)} ({nuc1} vs. {nuc2})" for i, nuc1, nuc2 in replacement_chars(repl))
     insertions1 = ", ".join(
         f"at {translation(i)} {''.join(seq_write_tuple[nuc] for nuc in frag)}" for i, frag in ins1.items())
     insertions2 = ", ".join(
@@ -47,9 +50,9 @@ def show_differences(repl: List[Tuple[int, int, int]], ins1: Dict[int, np.array]
     return "\t".join((replacements, insertions1, insertions2))
 
 
-def textual_differences(repl: List[Tuple[int, int, int]], ins1: Dict[int, np.array], ins2: Dict[int, np.array], translation: Callable[[int], str] = str) -> str:
-    repls_as_str = [(i, f"({seq_write_tuple[nuc1]} vs. {seq_write_tuple[nuc2]})")
-                    for i, nuc1, nuc2 in repl]
+def textual_differences(repl: Replacements, ins1: Dict[int, np.array], ins2: Dict[int, np.array], translation: Callable[[int], str] = str) -> str:
+    repls_as_str = [(i, f"({nuc1} vs. {nuc2})")
+                    for i, nuc1, nuc2 in replacement_chars(repl)]
     ins_as_str = [
         (i, f"(insertion {''.join(seq_write_tuple[nuc] for nuc in frag)})") for i, frag in ins1.items()]
     del_as_str = [
@@ -59,9 +62,9 @@ def textual_differences(repl: List[Tuple[int, int, int]], ins1: Dict[int, np.arr
     return and_join(listed_difference)
 
 
-def show_diag_differences(repl: List[Tuple[int, int, int]], ins1: Dict[int, np.array], ins2: Dict[int, np.array], translation: Callable[[int], str] = str) -> str:
-    repls_as_str = [(i, f"({seq_write_tuple[nuc1]})")
-                    for i, nuc1, nuc2 in repl]
+def show_diag_differences(repl: Replacements, ins1: Dict[int, np.array], ins2: Dict[int, np.array], translation: Callable[[int], str] = str) -> str:
+    repls_as_str = [(i, f"({nuc1})")
+                    for i, nuc1 in zip(repl.indices.tolist(), decode(repl.nucs1))]
     ins_as_str = [
         (i, f"(insertion {''.join(seq_write_tuple[nuc] for nuc in frag)})") for i, frag in ins1.items()]
     del_as_str = [
@@ -71,9 +74,9 @@ def show_diag_differences(repl: List[Tuple[int, int, int]], ins1: Dict[int, np.a
     return ", ".join(listed_difference)
 
 
-def diag_textual_differences(repl: List[Tuple[int, int, int]], ins1: Dict[int, np.array], ins2: Dict[int, np.array], translation: Callable[[int], str] = str) -> str:
-    repls_as_str = [(i, f"having a {seq_write_tuple[nuc1]}")
-                    for i, nuc1, _ in repl]
+def diag_textual_differences(repl: Replacements, ins1: Dict[int, np.array], ins2: Dict[int, np.array], translation: Callable[[int], str] = str) -> str:
+    repls_as_str = [(i, f"having a {nuc1}")
+                    for i, nuc1 in zip(repl.indices.tolist(), decode(repl.nucs1))]
     ins_as_str = [
         (i, f"having an insertion {''.join(seq_write_tuple[nuc] for nuc in frag)}") for i, frag in ins1.items()]
     del_as_str = [
@@ -83,88 +86,370 @@ def diag_textual_differences(repl: List[Tuple[int, int, int]], ins1: Dict[int, n
     return and_join(listed_difference)
 
 
+# names of the output files without the extension, in the order of writing
+OUTPUTS = ("Aligments", "Difference_matrix", "Difference_table", "Differences_description",
+           "Diagnostic_table", "Diagnostics_description")
+
+# reference name for process_files that selects the reference closest to the sequences, see DnaProcessor.closest_reference
+AUTO_REFERENCE = "auto"
+
+
+class Cancelled(Exception):
+    """
+    Raised by DnaProcessor.progress to stop the processing
+    """
+
+
 class DnaProcessor():
 
-    def __init__(self, output_dir: str) -> None:
+    def __init__(self, output_dir: str, config: Optional[Config] = None) -> None:
+        # scores of the alignment and reference sequences
+        self.config = config or default_config()
         self.infile: Optional[str] = None
+        # modification time and size of self.infile, when it was loaded
+        self.infile_stamp: Optional[Tuple[float, int]] = None
+        # metadata columns of the input file
         self.table: Optional[pd.DataFrame] = None
+        # unique encoded sequences (haplotypes) of the input file, if not aligned
+        self.sequences: Sequence[np.array] = []
+        # unique sequences of the input file, if aligned
+        self.matrix: Optional[SequenceMatrix] = None
+        # the last alignment of self.sequences with a reference
+        self.alignment: Optional[ReferenceAlignment] = None
+        # the matrix, the column and the insertions flag of the last combine_groups and its result
+        self.grouping: Optional[Tuple[SequenceMatrix, str, bool, SequenceMatrix, List[str]]] = None
+        # index of the haplotype of each row of self.table
+        self.haplotype_index = np.zeros(0, dtype=np.int64)
         self.aligned = False
         self.insertions = False
         self.relative_positions = False
+        # store two nucleotides per byte
+        self.packed = False
+        # number of processes for the alignment, 1 aligns in the current process
+        self.workers = 1
+        # persistent cache of the alignments
+        self.alignment_cache: Optional[AlignmentCache] = None
+        # align with the window of the reference around k-mer seeds, see FastAligner
+        self.fast_alignment = False
+        # outputs to write, see OUTPUTS. Only the computations needed for them are done
+        self.outputs: Set[str] = set(OUTPUTS)
+        # each is called with the stage, the number of finished steps and the total number of steps (0 if unknown),
+        # can raise Cancelled to stop the processing
+        self.progress_callbacks: List[Callable[[str, int, int], None]] = []
+        # write the profile of each run of process_files into run_profile.json in output_dir
+        self.write_profile = False
+        # profile the next run of process_files with cProfile and tracemalloc, which is slower
+        self.detailed_profile = False
+        # profile of the last run of process_files
+        self.run_profile: Optional[RunProfile] = None
+        # group, whose sequence is used to translate positions relative to the reference, the first one if None
+        self.position_group: Optional[str] = None
+        # number of rows of the input file that are read and encoded at once
+        self.load_chunk_size = 10000
+        # regular expression, whose named groups are the columns parsed from the headers of FASTA input
+        self.fasta_header_pattern = DEFAULT_FASTA_HEADER
+        # directory for the memory-mapped files of the haplotypes and the aligned sequences, they are kept in memory if None
+        self.out_of_core_dir: Optional[str] = None
+        # minimal fraction of shared k-mers for closest_reference
+        self.min_reference_score = MIN_REFERENCE_SCORE
         self.output_dir = output_dir
 
     def output(self, name) -> TextIO:
         filename = os.path.join(self.output_dir, name + ".txt")
         return open(filename, mode="w")
 
-    def load_table(self, infile: str) -> None:
-        with open(infile, errors='replace') as file:
-            table = pd.read_csv(file, delimiter='\t').rename(
-                columns=str.casefold).rename(columns=typos)
-        if 'sequence' not in table.columns:
-            raise ValueError("'sequences' or 'sequence' column is missing")
-        if 'specimenid' not in table.columns:
-            warnings.warn("Specimen IDs are not detected")
-        else:
-            table.set_index('specimenid', inplace=True)
-        if len(table.columns) < 2:
-            raise ValueError("'species' or another column need to be present")
-        if self.aligned:
-            table['sequence'] = table['sequence'].apply(Seq.from_str_notrim)
+    def step(self, stage: str, done: int = 0, total: int = 0) -> None:
+        """
+        Reports the progress of the stage to self.progress_callbacks
+        """
+        for callback in self.progress_callbacks:
+            callback(stage, done, total)
+
+    def stage(self, name: str, items: int = 0) -> ContextManager[Dict[str, Any]]:
+        """
+        Records the stage in self.run_profile during process_files, see RunProfile.stage
+        """
+        if self.run_profile is not None and self.run_profile.active:
+            return self.run_profile.stage(name, items)
         else:
-            table['sequence'] = table['sequence'].apply(Seq.from_str)
+            return nullcontext({})
+
+    def load_table(self, infile: str) -> None:
+        """
+        Loads an input file or a dataset file written by save_dataset
+        """
+        if is_dataset(infile):
+            self.load_dataset(infile)
+            return
+        self.step("Loading")
+        with self.stage("load") as record:
+            table, haplotypes, self.haplotype_index = read_table(
+                infile, aligned=self.aligned, chunk_size=self.load_chunk_size, header_pattern=self.fasta_header_pattern,
+                progress=lambda rows: self.step("Loading", rows), directory=self.out_of_core_dir)
+            if self.aligned:
+                self.matrix = SequenceMatrix.from_seqs(
+                    [Seq.from_data_notrim(data) for data in haplotypes], packed=self.packed, directory=self.out_of_core_dir)
+                self.sequences = []
+            else:
+                self.sequences = haplotypes
+                self.matrix = None
+            record['items'] = len(self.haplotype_index)
+        self.alignment = None
         self.table = table
+        self.set_infile(infile)
+
+    def load_dataset(self, infile: str) -> None:
+        """
+        Loads a dataset file written by save_dataset.
+
+        Sets self.aligned, if the dataset was saved from an already aligned file
+        """
+        dataset = read_dataset(infile, self.config)
+        self.table = dataset.table
+        self.haplotype_index = dataset.haplotype_index
+        self.sequences = dataset.sequences
+        self.matrix = dataset.matrix
+        self.alignment = dataset.alignment
+        self.aligned = dataset.aligned
+        self.set_infile(infile)
+
+    def set_infile(self, infile: str) -> None:
+        """
+        Records the loaded file, which invalidates the groups of the previous file
+        """
         self.infile = infile
+        self.infile_stamp = file_stamp(infile)
+        self.grouping = None
 
-    def process_files(self, infile: str, reference_name: str, column: str, selection: List[str]) -> None:
+    def save_dataset(self, path: str, reference_name: Optional[str] = None) -> None:
+        """
+        Saves the loaded file as a dataset file, which is loaded much faster than the input file.
+
+        If reference_name is given and the sequences are not already aligned,
+        they are aligned with the reference and the alignment is saved as well.
+        """
+        if self.table is None:
+            raise ValueError('Input file is not loaded')
+        alignment = self.align(
+            reference_name) if reference_name and not self.aligned else None
+        write_dataset(path, Dataset(self.table, self.haplotype_index,
+                                    self.sequences, self.matrix, alignment))
+
+    def rank_references(self, sample: Optional[int] = 200) -> List[Tuple[str, float]]:
+        """
+        Returns the names of the references with the mean fraction of k-mers they share with a sample of the loaded sequences, best first.
+
+        See ReferencePanelIndex.rank
+        """
+        if self.table is None:
+            raise ValueError('Input file is not loaded')
+        self.step("Detecting the reference")
+        with self.stage("detect reference"):
+            if self.matrix is not None:
+                # only the sampled rows are unpacked
+                matrix = self.matrix
+                return self.config.reference_index.rank(
+                    [matrix.codes(slice(i, i + 1))[0] for i in sample_indices(len(matrix), sample)], None)
+            else:
+                return self.config.reference_index.rank(self.sequences, sample)
+
+    def closest_reference(self) -> Tuple[str, float]:
+        """
+        Returns the best reference from rank_references and its score.
+
+        Raises ValueError, if its score is below self.min_reference_score
+        """
+        reference_name, score = self.rank_references()[0]
+        if score < self.min_reference_score:
+            raise ValueError(
+                f"No reference sequence is close to the sequences, the closest one, {reference_name}, shares only {score:.0%} of the k-mers")
+        self.step(
+            f"The closest reference is {reference_name} ({score:.0%} of the k-mers are shared)")
+        return reference_name, score
+
+    def align(self, reference_name: str) -> ReferenceAlignment:
+        """
+        Aligns the loaded sequences with the reference.
+
+        The last alignment is reused, if the reference, the scores and the alignment options are the same.
+        It is discarded, when another file is loaded
+        """
+        method = "fast" if self.fast_alignment else "exact"
+        reference = self.config.references[reference_name]
+        reference_key = AlignmentCache.reference_key(
+            reference_name, reference.data, method, self.config)
+        alignment = self.alignment
+        if alignment is None or (alignment.reference_key, alignment.matrix.packed) != (reference_key, self.packed):
+            with self.stage("align", len(self.sequences)):
+                matrix, displays = align_sequences(
+                    self.sequences, reference, packed=self.packed, workers=self.workers,
+                    cache=self.alignment_cache, reference_name=reference_name, fast=self.fast_alignment, directory=self.out_of_core_dir,
+                    progress=lambda done, total: self.step("Aligning", done, total), config=self.config)
+            alignment = ReferenceAlignment(
+                reference_name, method, matrix, displays, self.config)
+            self.alignment = alignment
+        return alignment
+
+    def process_files(self, infile: str, reference_name: str, column: str, selection: List[str], keep_selection: bool = False) -> None:
+        """
+        Writes the selected outputs for the input file, recording the run, including the loading, in self.run_profile
+
+        If the file is not loaded yet, the column species and all its values are used, unless keep_selection is set.
+        If reference_name is AUTO_REFERENCE, the sequences are aligned with closest_reference
+        """
+        self.run_profile = RunProfile(detailed=self.detailed_profile)
+        self.detailed_profile = False
+        try:
+            with self.run_profile:
+                self.process_loaded(infile, reference_name,
+                                    column, selection, keep_selection)
+        finally:
+            if self.write_profile:
+                self.run_profile.write(os.path.join(self.output_dir, "run_profile"))
+
+    def process_loaded(self, infile: str, reference_name: str, column: str, selection: List[str], keep_selection: bool = False) -> None:
         if not infile:
             raise ValueError('Input file is not given')
         if self.infile != infile:
             self.load_table(infile)
-            column = "species"
-            selection = []
+            if not keep_selection:
+                column = "species"
+                selection = []
+        elif self.aligned != (self.matrix is not None) or self.infile_stamp != file_stamp(infile):
+            # the file was loaded with a different value of self.aligned or it was modified since
+            self.load_table(infile)
         assert(self.table is not None)
         if len(selection) == 1:
             raise ValueError(
                 "Please select at least two categories for comparison")
-        reference_sequence = references[reference_name]
-        alignment_displays = self.table['sequence'].apply(
-            lambda seq: seq.align(reference_sequence)) if not self.aligned else self.table['sequence']
-        if not self.insertions:
-            self.table['sequence'].apply(Seq.reset_insertions)
-        try:
-            table = self.table.groupby(
-                column)['sequence'].agg(combine_sequences)
-        except ValueError as ex:
-            raise ValueError("The sequences seem to not be aligned") from ex
-        position_translator = table.iat[0].make_position_tranlator(
-            reference_sequence)
+        if reference_name == AUTO_REFERENCE:
+            reference_name, _ = self.closest_reference()
+        reference_sequence = self.config.references[reference_name]
+        if self.aligned:
+            assert(self.matrix is not None)
+            matrix = self.matrix
+            haplotype_displays: Sequence[str] = SequenceDisplays(matrix)
+        else:
+            alignment = self.align(reference_name)
+            matrix = alignment.matrix
+            haplotype_displays = alignment.displays
+        if "Aligments" in self.outputs:
+            self.step("Writing alignments")
+            with self.stage("alignments output", len(self.table)), self.output("Aligments") as output:
+                print("Alignments:", file=output)
+                column_values = self.table[column]
+                for i, (specimen, haplotype) in enumerate(zip(self.table.index, self.haplotype_index.tolist())):
+                    if not selection or column_values.iat[i] in selection:
+                        print(specimen, file=output)
+                        print(haplotype_displays[haplotype], file=output)
+                output.write("\n")
+        if not self.outputs & set(OUTPUTS[1:]):
+            # only the alignments are written
+            return
+        groups, group_names = self.combine_groups(matrix, column)
+        if self.relative_positions:
+            position_translator = self.position_translator(
+                groups, group_names, reference_sequence)
         if selection:
-            table = table.filter(items=selection).sort_index()
-        with self.output("Aligments") as output:
-            print("Alignments:", file=output)
-            for specimen, alignment_str in alignment_displays.items():
-                if not selection or self.table[column][specimen] in selection:
-                    print(specimen, file=output)
-                    print(alignment_str, file=output)
-            output.write("\n")
+            selected = [i for i, name in enumerate(group_names) if name in selection]
+            groups = groups.take(selected)
+            group_names = [group_names[i] for i in selected]
         if self.relative_positions:
-            self.report(table, column, reference_name,
-                        lambda i: position_translator[i])
+            self.report(groups, group_names, column, reference_name,
+                        position_translator)
         else:
             if not self.aligned:
-                self.report(table, column, reference_name)
+                self.report(groups, group_names, column, reference_name)
             else:
-                self.report(table, column, None)
+                self.report(groups, group_names, column, None)
+
+    def combine_groups(self, matrix: SequenceMatrix, column: str) -> Tuple[SequenceMatrix, List[str]]:
+        """
+        Returns the combined sequences of the groups of the rows by the values of the column and the names of the groups.
 
+        The result is reused while the matrix, the column and self.insertions are the same,
+        so that only the reports are redone, when the selection changes
+        """
+        assert(self.table is not None)
+        if self.grouping is not None:
+            source, grouping_column, insertions, groups, group_names = self.grouping
+            if source is matrix and (grouping_column, insertions) == (column, self.insertions):
+                return groups, group_names
+        source = matrix
+        if not self.insertions:
+            with self.stage("reset insertions", len(matrix.insertions)):
+                matrix = matrix.without_insertions()
+        self.step("Grouping")
+        with self.stage("combine") as record:
+            grouping = self.table.groupby(column)
+            group_names = list(grouping.size().index)
+            # rows with an empty value are outside of all groups, ngroup gives them NaN
+            groups = matrix.combine(grouping.ngroup().fillna(-1).astype(np.int64).to_numpy(), len(
+                group_names), self.haplotype_index)
+            record['items'] = len(group_names)
+        self.grouping = (source, column, self.insertions, groups, group_names)
+        return groups, group_names
+
+    def position_translator(self, groups: SequenceMatrix, group_names: List[str], reference_sequence: Seq) -> PositionTranslator:
+        """
+        Returns the translator of the positions in the combined sequences of groups into positions relative to the reference
+        """
+        if not self.aligned:
+            # the alignment with the reference has already put the sequences into its coordinates
+            return PositionTranslator.identity(groups.width)
+        if self.position_group is None:
+            i = 0
+        elif self.position_group in group_names:
+            i = group_names.index(self.position_group)
+        else:
+            raise ValueError(
+                f"The group '{self.position_group}' for the relative positions is not a value of the grouping column")
+        return groups.row(i).make_position_tranlator(reference_sequence, self.config)
+
+    def report(self, groups: SequenceMatrix, group_names: List[str], column: str, reference_name: Optional[str], translation: Callable[[int], str] = str) -> None:
+        """
+        Writes the comparison of the combined sequences of the groups into the selected outputs
+        """
+        pairwise_outputs = {"Difference_table", "Differences_description"} & self.outputs
+        if "Difference_matrix" in self.outputs or pairwise_outputs:
+            self.step("Difference matrix")
+            with self.stage("difference matrix", len(group_names) ** 2):
+                counts = difference_counts(groups)
+                if "Difference_matrix" in self.outputs:
+                    with self.output("Difference_matrix") as matrixOutput:
+                        write_difference_matrix(
+                            counts, group_names, matrixOutput)
 
-    def report(self, table: pd.Series, column: str, reference_name: Optional[str], translation: Callable[[int], str] = str) -> None:
-        with self.output("Difference_matrix") as matrixOutput, self.output("Difference_table") as tableOutput, self.output("Differences_description") as textOutput:
-            print("", *table.index, sep='\t', file=matrixOutput)
+        if pairwise_outputs:
+            with self.stage("pairwise report", len(group_names) ** 2):
+                self.report_pairwise(groups, group_names, column,
+                                     reference_name, counts, translation)
+
+        if {"Diagnostic_table", "Diagnostics_description"} & self.outputs:
+            with self.stage("diagnostic report", len(group_names)):
+                self.report_diagnostics(
+                    groups, group_names, column, reference_name, translation)
+
+    def optional_output(self, name: str) -> TextIO:
+        """
+        Returns the output file, if it is selected, otherwise a file that discards the text
+        """
+        if name in self.outputs:
+            return self.output(name)
+        else:
+            return open(os.devnull, mode="w")
+
+    def report_pairwise(self, groups: SequenceMatrix, group_names: List[str], column: str, reference_name: Optional[str], counts: np.array, translation: Callable[[int], str]) -> None:
+        """
+        Writes the differences of each pair of groups
+        """
+        write_table = "Difference_table" in self.outputs
+        write_text = "Differences_description" in self.outputs
+        with self.optional_output("Difference_table") as tableOutput, self.optional_output("Differences_description") as textOutput:
             print(
                 f"{column} 1\t{column} 2\treplacements\tinsertions 1\tinsertions 2", file=tableOutput)
-            for species1 in table.index:
-                matrixOutput.write(species1)
+            for i, species1 in enumerate(group_names):
+                self.step("Comparing pairs", i, len(group_names))
                 if reference_name:
                     textOutput.write(
                         f"Using nucleotide positions in the {reference_name} sequence as a reference, {species1} differs ")
@@ -172,41 +457,42 @@ class DnaProcessor():
                     textOutput.write(
                         f"{species1} differs ")
                 textFragments = []
-                for species2 in table.index:
+                for j, species2 in enumerate(group_names):
                     repl, ins1, ins2 = differences(
-                        table[species1], table[species2])
-                    insertions_num = sum(
-                        map(len, ins1.values())) + sum(map(len, ins2.values()))
-                    difference_num = len(repl) + insertions_num
-                    if species1 >= species2:
-                        matrixOutput.write(f"\t{difference_num}")
-                    if species1 != species2:
+                        groups.row(i), groups.row(j))
+                    difference_num = counts[i, j]
+                    if write_table and species1 != species2:
                         print(species1, species2, show_differences(
                             repl, ins1, ins2, translation), sep='\t', file=tableOutput)
-                    if difference_num > 0:
+                    if write_text and difference_num > 0:
                         textFragments.append(
                             f"from {species2} in nucleotide {'position' if difference_num == 1 else 'positions'} " +
                             textual_differences(repl, ins1, ins2, translation))
                 textOutput.write(
                     and_join(textFragments))
                 textOutput.write("\n\n")
-                matrixOutput.write("\n")
 
-        diag_tableOutput = io.StringIO("")
-        diag_textOutput = io.StringIO("")
-        with self.output("Diagnostic_table") as diag_tableOutput, self.output("Diagnostics_description") as diag_textOutput:
+    def report_diagnostics(self, groups: SequenceMatrix, group_names: List[str], column: str, reference_name: Optional[str], translation: Callable[[int], str]) -> None:
+        """
+        Writes the differences of each group from all other groups
+        """
+        write_text = "Diagnostics_description" in self.outputs
+        with self.optional_output("Diagnostic_table") as diag_tableOutput, self.optional_output("Diagnostics_description") as diag_textOutput:
             print(f"{column}\tUnique diagnostic differences",
                   file=diag_tableOutput)
-            for species1 in table.index:
-                other_species_seq: Seq = combine_sequences(table.drop(
-                    labels=species1))
+            self.step("Diagnostics")
+            other_groups = groups.union_of_others()
+            for i, species1 in enumerate(group_names):
+                self.step("Diagnostics", i, len(group_names))
                 repl, ins1, ins2 = differences(
-                    table[species1], other_species_seq)
+                    groups.row(i), other_groups.row(i))
                 text = show_diag_differences(repl, ins1, ins2, translation)
                 if text:
                     print(species1, text, sep='\t', file=diag_tableOutput)
                 else:
                     print(species1, "None", sep='\t', file=diag_tableOutput)
+                if not write_text:
+                    continue
                 text = diag_textual_differences(repl, ins1, ins2, translation)
                 if text:
                     diag_textOutput.write(
@@ -223,4 +509,4 @@ class DnaProcessor():
         Returns the columns that contain values for grouping
         """
         assert(self.table is not None)
-        return {column_name: list(self.table[column_name].unique()) for column_name in self.table.columns if column_name != "sequence"}
+        return {column_name: list(self.table[column_name].unique()) for column_name in self.table.columns}
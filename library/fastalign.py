@@ -0,0 +1,190 @@
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from library.seq import align_coordinates
+from library.config import Config, default_config
+
+# 2-bit values of the unambiguous nucleotides in k-mers, -1 for gaps and ambiguous codes
+kmer_values = np.full(16, -1, dtype=np.int64)
+kmer_values[[1, 2, 4, 8]] = np.arange(4)
+
+
+def kmers(data: np.array, k: int) -> Tuple[np.array, np.array]:
+    """
+    Returns the k-mers of data encoded as integers and their positions.
+
+    The k-mers containing gaps or ambiguous nucleotides are skipped, k should be at most 31
+    """
+    if len(data) < k:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    windows = sliding_window_view(kmer_values[data], k)
+    valid = (windows >= 0).all(axis=1)
+    return windows[valid] @ (4 ** np.arange(k - 1, -1, -1, dtype=np.int64)), np.flatnonzero(valid)
+
+
+class ReferenceIndex:
+    """
+    Sorted k-mers of a reference that occur in it only once, with their positions
+    """
+
+    def __init__(self, ref_data: np.array, k: int = 12) -> None:
+        self.k = k
+        codes, positions = kmers(ref_data, k)
+        unique_codes, first, counts = np.unique(
+            codes, return_index=True, return_counts=True)
+        self.kmers = unique_codes[counts == 1]
+        self.positions = positions[first[counts == 1]]
+
+    def seeds(self, data: np.array) -> Tuple[np.array, np.array]:
+        """
+        Returns the positions in data and in the reference of the k-mers of data found in the index
+        """
+        codes, positions = kmers(data, self.k)
+        found = np.searchsorted(self.kmers, codes).clip(
+            max=max(len(self.kmers) - 1, 0))
+        if not len(self.kmers):
+            found_mask = np.zeros(len(codes), dtype=bool)
+        else:
+            found_mask = self.kmers[found] == codes
+        return positions[found_mask], self.positions[found[found_mask]]
+
+
+class FastAligner:
+    """
+    Aligns sequences with a reference by aligning them only with the window of the reference around the diagonal found by k-mer seeds.
+
+    The window covers the diagonals of the seeds consistent with the median diagonal, widened by band on each side.
+    Outside of the window the reference is an end gap, so the alignment inside it is the same as the full one,
+    as long as the full alignment lies inside the window.
+    The full alignment is used instead, when there are less than min_seeds consistent seeds,
+    they make up less than min_confidence of the k-mers of the sequence
+    or the alignment in the window comes closer than band // 2 to one of its cropped edges.
+
+    The alignments use the aligner of config or default_config().
+    """
+
+    def __init__(self, ref_data: np.array, k: int = 12, band: int = 32, min_seeds: int = 8, min_confidence: float = 0.3,
+                 config: Optional[Config] = None) -> None:
+        self.ref_data = ref_data
+        self.config = config or default_config()
+        self.index = ReferenceIndex(ref_data, k)
+        self.band = band
+        self.min_seeds = min_seeds
+        self.min_confidence = min_confidence
+        # number of sequences aligned with the full reference
+        self.fallbacks = 0
+
+    def window(self, data: np.array) -> Optional[Tuple[int, int]]:
+        """
+        Returns the window of the reference for data or None, if the seeds are not reliable
+        """
+        query_positions, ref_positions = self.index.seeds(data)
+        if len(query_positions) < self.min_seeds:
+            return None
+        diagonals = ref_positions - query_positions
+        consistent = diagonals[np.abs(
+            diagonals - np.median(diagonals)) <= self.band]
+        if len(consistent) < max(self.min_seeds, self.min_confidence * max(len(data) - self.index.k + 1, 1)):
+            return None
+        return max(int(consistent.min()) - self.band, 0), min(int(consistent.max()) + len(data) + self.band, len(self.ref_data))
+
+    def align_coordinates(self, data: np.array) -> np.array:
+        """
+        Returns the coordinates of the alignment of data with the reference, like library.seq.align_coordinates
+        """
+        window = self.window(data)
+        if window is None or window == (0, len(self.ref_data)):
+            if window is None:
+                self.fallbacks += 1
+            return align_coordinates(data, self.ref_data, self.config)
+        window_start, window_end = window
+        coordinates = align_coordinates(
+            data, self.ref_data[window_start:window_end], self.config).copy()
+        steps = np.diff(coordinates, axis=1)
+        blocks = np.flatnonzero((steps[0] > 0) & (steps[1] > 0))
+        margin = self.band // 2
+        if not len(blocks) or (window_start > 0 and coordinates[0, blocks[0]] < margin) or (
+                window_end < len(self.ref_data) and coordinates[0, blocks[-1] + 1] > window_end - window_start - margin):
+            self.fallbacks += 1
+            return align_coordinates(data, self.ref_data, self.config)
+        coordinates[0] += window_start
+        # extend the end gaps of data to the ends of the reference
+        if window_start > 0:
+            if coordinates[1, 1] == 0:
+                coordinates[0, 0] = 0
+            else:
+                coordinates = np.concatenate(
+                    (np.zeros((2, 1), dtype=coordinates.dtype), coordinates), axis=1)
+        if window_end < len(self.ref_data):
+            if coordinates[1, -2] == len(data):
+                coordinates[0, -1] = len(self.ref_data)
+            else:
+                coordinates = np.concatenate(
+                    (coordinates, np.array([[len(self.ref_data)], [len(data)]], dtype=coordinates.dtype)), axis=1)
+        return coordinates
+
+
+def alignment_score(data: np.array, ref_data: np.array, coordinates: np.array, config: Optional[Config] = None) -> float:
+    """
+    Returns the score of the alignment given by coordinates with the scores of config or default_config()
+    """
+    config = config or default_config()
+    score_matrix = config.score_matrix
+    score = 0.0
+    for (ref_start, query_start), (ref_end, query_end) in zip(coordinates.T[:-1], coordinates.T[1:]):
+        if ref_end > ref_start and query_end > query_start:
+            score += score_matrix[ref_data[ref_start:ref_end],
+                                  data[query_start:query_end]].sum()
+            continue
+        elif ref_end > ref_start:
+            # gap in data
+            end_gap = query_start in (0, len(data))
+        else:
+            # gap in the reference
+            end_gap = ref_start in (0, len(ref_data))
+        length = max(ref_end - ref_start, query_end - query_start)
+        if end_gap:
+            score += config.end_gap_penalty + (length - 1) * config.end_gap_extend_penalty
+        else:
+            score += config.gap_penalty + (length - 1) * config.gap_extend_penalty
+    return score
+
+
+def compare_alignment_modes(sequences: Sequence[np.array], ref_data: np.array, config: Optional[Config] = None, **options: float) -> Dict[str, float]:
+    """
+    Aligns the encoded sequences with ref_data with align_coordinates and with FastAligner(ref_data, **options).
+
+    Returns the number of sequences, the number of identical alignments, the number of fallbacks to the full alignment,
+    the total and maximal score lost by the fast alignment and the time taken by each mode
+    """
+    config = config or default_config()
+    fast_aligner = FastAligner(ref_data, config=config, **options)  # type: ignore
+    exact_time = 0.0
+    fast_time = 0.0
+    identical = 0
+    score_losses = []
+    for data in sequences:
+        start = time.perf_counter()
+        exact = align_coordinates(data, ref_data, config)
+        exact_time += time.perf_counter() - start
+        start = time.perf_counter()
+        fast = fast_aligner.align_coordinates(data)
+        fast_time += time.perf_counter() - start
+        if exact.shape == fast.shape and (exact == fast).all():
+            identical += 1
+            score_losses.append(0.0)
+        else:
+            score_losses.append(alignment_score(data, ref_data, exact, config) -
+                                alignment_score(data, ref_data, fast, config))
+    return dict(
+        sequences=len(sequences),
+        identical=identical,
+        fallbacks=fast_aligner.fallbacks,
+        total_score_loss=sum(score_losses),
+        max_score_loss=max(score_losses, default=0.0),
+        exact_time=exact_time,
+        fast_time=fast_time,
+    )
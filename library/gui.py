@@ -2,7 +2,10 @@ import os
 import sys
 import shutil
 import warnings
-from typing import Any, Callable, Iterator, Optional
+import queue
+import threading
+import traceback
+from typing import Any, Callable, Iterator, List, Optional, Tuple
 
 import tkinter as tk
 import tkinter.ttk as ttk
@@ -10,8 +13,8 @@ import tkinter.font as tkfont
 import tkinter.messagebox as tkmessagebox
 import tkinter.filedialog as tkfiledialog
 
-from library.dnaprocessor import references, DnaProcessor
-from library.gui_utils import ColumnSelector
+from library.dnaprocessor import DnaProcessor, OUTPUTS, Cancelled
+from library.gui_utils import ColumnSelector, TextPreview
 
 
 class DNADiagnoserGUI(ttk.Frame):
@@ -29,6 +32,11 @@ class DNADiagnoserGUI(ttk.Frame):
         self.preview_dir = preview_dir
 
         self.dnaprocessor = DnaProcessor(self.preview_dir)
+        # thread that runs the processing, see run_in_background
+        self.worker: Optional[threading.Thread] = None
+        self.cancel_event = threading.Event()
+        # whether a task of run_in_background hasn't finished, the options are applied to self.dnaprocessor after it
+        self.running = False
 
         self.panes = ttk.Panedwindow(self, orient='horizontal')
         self.panes.grid(row=3, column=0, sticky="nsew")
@@ -40,6 +48,8 @@ class DNADiagnoserGUI(ttk.Frame):
         self.insertions.trace_add('write', self.update_dna_processor)
         self.aligned.trace_add('write', self.update_dna_processor)
         self.relative_positions.trace_add('write', self.update_dna_processor)
+        for output_var in self.output_vars.values():
+            output_var.trace_add('write', self.update_dna_processor)
 
         ttk.Separator(self, orient="horizontal").grid(
             row=1, column=0, sticky="we")
@@ -48,15 +58,23 @@ class DNADiagnoserGUI(ttk.Frame):
         ttk.Entry(self, textvariable=self.input_file).grid(
             row=2, column=0, sticky="we")
 
+        self.create_progress_frame()
+
         self.rowconfigure(3, weight=1)
         self.columnconfigure(0, weight=1)
         self.grid(row=0, column=0, sticky="nsew")
 
     def update_dna_processor(self, name1: str, name2: str, op: str) -> None:
         del name1, name2, op  # Unneeded arguments
+        if not self.running:
+            self.apply_options()
+
+    def apply_options(self) -> None:
         self.dnaprocessor.aligned = self.aligned.get()
         self.dnaprocessor.relative_positions = self.relative_positions.get()
         self.dnaprocessor.insertions = self.insertions.get()
+        self.dnaprocessor.outputs = {
+            name for name, output_var in self.output_vars.items() if output_var.get()}
 
     def create_top_frame(self) -> None:
         top_frame = ttk.Frame(self, relief="sunken", padding=4)
@@ -108,39 +126,156 @@ class DNADiagnoserGUI(ttk.Frame):
                 shutil.copy(full_filename, save_folder)
         return command
 
-    def run_command(self) -> None:
-        self.clear_command()
-        self.update()
-        try:
+    def create_progress_frame(self) -> None:
+        progress_frame = ttk.Frame(self, padding=2)
+        progress_frame.columnconfigure(1, weight=1)
+        progress_frame.grid(row=4, column=0, sticky="we")
+
+        self.progress_label = ttk.Label(progress_frame, width=30)
+        self.progress_label.grid(row=0, column=0, sticky="w")
+        self.progress_bar = ttk.Progressbar(
+            progress_frame, orient="horizontal", mode="determinate")
+        self.progress_bar.grid(row=0, column=1, sticky="we")
+        self.cancel_button = ttk.Button(
+            progress_frame, text="Cancel", command=self.cancel_event.set, state="disabled")
+        self.cancel_button.grid(row=0, column=2, sticky="e")
+
+    def show_progress(self, stage: str, done: int, total: int) -> None:
+        if total:
+            self.progress_bar.configure(mode="determinate", maximum=total, value=done)
+            self.progress_label.configure(text=f"{stage} {done}/{total}")
+        else:
+            self.progress_bar.configure(mode="indeterminate")
+            self.progress_bar.step()
+            self.progress_label.configure(
+                text=f"{stage} {done}" if done else stage)
+
+    def run_in_background(self, task: Callable[[], None], on_done: Callable[[], None]) -> None:
+        """
+        Runs task in a worker thread, showing the progress of self.dnaprocessor.
+
+        Warnings and errors of the task are shown in the UI thread, which calls on_done, if the task is complete.
+        The Cancel button stops the task at the next progress report.
+        The options changed during the task are applied to self.dnaprocessor when it ends.
+        """
+        if self.worker is not None and self.worker.is_alive():
+            tkmessagebox.showwarning("Warning", "The processing is already running")
+            return
+        messages: "queue.Queue[Tuple[str, ...]]" = queue.Queue()
+        self.cancel_event.clear()
+
+        def progress(stage: str, done: int, total: int) -> None:
+            if self.cancel_event.is_set():
+                raise Cancelled()
+            messages.put(("progress", stage, str(done), str(total)))
+
+        def work() -> None:
+            result: Tuple[str, ...] = ("done",)
             with warnings.catch_warnings(record=True) as warns:
-                selection = self.column_selector.selection()
-                if selection:
-                    column, selected = selection
+                try:
+                    task()
+                except Cancelled:
+                    result = ("cancelled",)
+                except Exception as ex:
+                    traceback.print_exc()
+                    result = ("error", str(ex))
+                finally:
+                    self.dnaprocessor.progress_callbacks.remove(progress)
+            for w in warns:
+                messages.put(("warning", str(w.message)))
+            messages.put(result)
+
+        def poll() -> None:
+            # only the latest progress is shown
+            latest_progress = None
+            while True:
+                try:
+                    kind, *args = messages.get_nowait()
+                except queue.Empty:
+                    if latest_progress is not None:
+                        self.show_progress(*latest_progress)
+                    self.after(100, poll)
+                    return
+                if kind == "progress":
+                    stage, done, total = args
+                    latest_progress = (stage, int(done), int(total))
+                    continue
+                elif kind == "warning":
+                    tkmessagebox.showwarning("Warning", args[0])
+                    continue
+                self.running = False
+                self.apply_options()
+                self.cancel_button.configure(state="disabled")
+                self.progress_bar.configure(mode="determinate", value=0)
+                if kind == "error":
+                    self.progress_label.configure(text="Failed")
+                    tkmessagebox.showerror("Error", args[0])
+                elif kind == "cancelled":
+                    self.progress_label.configure(text="Cancelled")
                 else:
-                    column, selected = ('species', [])
-                self.dnaprocessor.process_files(self.input_file.get(),
-                                                self.reference_seq.get(), column, selected)
-                for w in warns:
-                    tkmessagebox.showwarning("Warning", str(w.message))
-        except Exception as ex:
-            tkmessagebox.showerror("Error", str(ex))
-            raise
+                    self.progress_label.configure(text="Done")
+                    on_done()
+                return
+
+        self.dnaprocessor.progress_callbacks.append(progress)
+        self.running = True
+        self.cancel_button.configure(state="normal")
+        self.worker = threading.Thread(target=work, daemon=True)
+        self.worker.start()
+        self.after(100, poll)
+
+    def run_command(self) -> None:
+        self.clear_command()
+        selection = self.column_selector.selection()
+        if selection:
+            column, selected = selection
         else:
+            column, selected = ('species', [])
+        infile = self.input_file.get()
+        reference_name = self.reference_seq.get()
+
+        def on_done() -> None:
             tkmessagebox.showinfo("Done", "Analysis is complete")
             self.fill_file_list()
 
+        self.run_in_background(lambda: self.dnaprocessor.process_files(
+            infile, reference_name, column, selected), on_done)
+
     def load_file(self):
-        try:
-            infile: Optional[str] = self.input_file.get()
-            if infile:
+        infile: Optional[str] = self.input_file.get()
+        if infile:
+            self.run_in_background(lambda: self.dnaprocessor.load_table(infile),
+                                   lambda: self.column_selector.set_columns(self.dnaprocessor.choices()))
+
+    def detect_reference(self) -> None:
+        """
+        Selects the reference closest to the sequences of the input file
+        """
+        infile = self.input_file.get()
+        if not infile:
+            tkmessagebox.showwarning("Warning", "Please select the input file")
+            return
+        loading = self.dnaprocessor.infile != infile
+        closest: List[Tuple[str, float]] = []
+
+        def detect() -> None:
+            if loading:
                 self.dnaprocessor.load_table(infile)
+            closest.append(self.dnaprocessor.closest_reference())
+
+        def on_done() -> None:
+            if loading:
                 self.column_selector.set_columns(self.dnaprocessor.choices())
-        except Exception as ex:
-            tkmessagebox.showerror("Error", str(ex))
+            reference_name, score = closest[0]
+            self.reference_seq.set(reference_name)
+            tkmessagebox.showinfo(
+                "Reference", f"The closest reference is {reference_name} ({score:.0%} of the k-mers are shared)")
+
+        self.run_in_background(detect, on_done)
 
     def clear_command(self) -> None:
         self.filelist.delete(*self.filelist.get_children())
-        self.preview.delete("1.0", "end")
+        self.preview.clear()
         self.preview_frame.configure(text="Preview")
 
     def outfilenames(self, which: str) -> Iterator[str]:
@@ -162,11 +297,15 @@ class DNADiagnoserGUI(ttk.Frame):
         ttk.Label(parameters_frame, text="Reference sequence").grid(
             row=0, column=0, sticky="w")
 
+        reference_frame = ttk.Frame(parameters_frame)
+        reference_frame.grid(row=1, column=0, sticky='w')
         self.reference_seq = tk.StringVar()
-        reference_cmb = ttk.Combobox(parameters_frame, textvariable=self.reference_seq, values=tuple(
-            references.keys()), state='readonly')
+        reference_cmb = ttk.Combobox(reference_frame, textvariable=self.reference_seq, values=tuple(
+            self.dnaprocessor.config.references.keys()), state='readonly')
         reference_cmb.current(0)
-        reference_cmb.grid(row=1, column=0, sticky='w')
+        reference_cmb.grid(row=0, column=0, sticky='w')
+        ttk.Button(reference_frame, text="Detect", command=self.detect_reference).grid(
+            row=0, column=1, sticky='w')
 
         self.insertions = tk.BooleanVar(self, value=False)
         ttk.Checkbutton(parameters_frame, variable=self.insertions,
@@ -193,6 +332,14 @@ class DNADiagnoserGUI(ttk.Frame):
 
         self.make_column_selector(parameters_frame)
 
+        outputs_frame = ttk.LabelFrame(parameters_frame, text="Outputs")
+        outputs_frame.grid(row=6, column=0, sticky='nsew')
+        self.output_vars = {}
+        for row, name in enumerate(OUTPUTS):
+            self.output_vars[name] = tk.BooleanVar(self, value=True)
+            ttk.Checkbutton(outputs_frame, variable=self.output_vars[name],
+                            text=name).grid(row=row, column=0, sticky='w')
+
     def make_column_selector(self, frame: ttk.LabelFrame) -> None:
         selector_frame = ttk.Frame(frame, padding=3)
         selector_frame.rowconfigure(1, weight=1)
@@ -239,7 +386,7 @@ class DNADiagnoserGUI(ttk.Frame):
         self.filelist.bind("<<TreeviewSelect>>", self.preview_selected)
 
     def icon_for_file(self, filename) -> tk.PhotoImage:
-        TXT_EXTS = {".txt", ".tab", ".tsv", ".csv"}
+        TXT_EXTS = {".txt", ".tab", ".tsv", ".csv", ".json"}
         _, ext = os.path.splitext(filename)
         if ext in TXT_EXTS:
             return self.images["txt_icon"]
@@ -264,22 +411,11 @@ class DNADiagnoserGUI(ttk.Frame):
         self.preview_frame.columnconfigure(0, weight=1)
         self.panes.add(self.preview_frame, weight=1)
 
-        self.preview = tk.Text(
-            self.preview_frame, height=15, width=30, wrap="none")
+        self.preview = TextPreview(self.preview_frame)
         self.preview.grid(row=0, column=0, sticky="nsew")
 
-        yscroll = ttk.Scrollbar(
-            self.preview_frame, orient='vertical', command=self.preview.yview)
-        self.preview.config(yscrollcommand=yscroll.set)
-        yscroll.grid(row=0, column=1, sticky="nsew")
-
-        xscroll = ttk.Scrollbar(
-            self.preview_frame, orient='horizontal', command=self.preview.xview)
-        self.preview.config(xscrollcommand=xscroll.set)
-        xscroll.grid(row=1, column=0, sticky="nsew")
-
     def preview_selected(self, _) -> None:
-        self.preview.delete("1.0", "end")
+        self.preview.clear()
         if not self.filelist.selection():
             return
         selected_index = self.filelist.selection()[-1]
@@ -287,7 +423,7 @@ class DNADiagnoserGUI(ttk.Frame):
             text=f'Preview - {self.filelist.item(selected_index, option="text")}')
         file_to_preview = os.path.join(
             self.preview_dir, self.filelist.item(selected_index, option="text"))
-        TXT_EXTS = {".txt", ".tab", ".tsv", ".csv", ".log"}
+        TXT_EXTS = {".txt", ".tab", ".tsv", ".csv", ".log", ".json"}
         IMG_EXTS = {".gif", ".png", ".pbm", ".pgm", ".ppm", ".pnm"}
         _, ext = os.path.splitext(file_to_preview)
         if ext in TXT_EXTS:
@@ -298,15 +434,14 @@ class DNADiagnoserGUI(ttk.Frame):
             self.no_preview(file_to_preview)
 
     def preview_txt(self, filename) -> None:
-        with open(filename) as file:
-            self.preview.insert("1.0", file.read())
+        self.preview.open(filename)
 
     def preview_img(self, filename) -> None:
         self.images["current"] = tk.PhotoImage(file=filename)
-        self.preview.image_create("1.0", image=self.images["current"])
+        self.preview.show_image(self.images["current"])
 
     def no_preview(self, _) -> None:
-        self.preview.insert("1.0", "Preview is not possible")
+        self.preview.show_message("Preview is not possible")
 
 
 def test_look() -> None:
@@ -2,7 +2,10 @@ import os.path
 import tkinter as tk
 import tkinter.filedialog as tkfiledialog
 import tkinter.ttk as ttk
-from typing import Any, Dict, Tuple, List, Optional
+import tkinter.font as tkfont
+from typing import Any, Dict, Tuple, List, Optional, Union
+
+from library.lineindex import LineIndex
 
 
 class FileChooser():
@@ -115,3 +118,199 @@ class ColumnSelector():
             return None
         i = self.notebook.index("current")
         return (self.notebook.tab(i)["text"], self.lists[i].selection())
+
+
+class TextPreview():
+    """
+    Text widget with scrollbars for previewing files, and a search bar.
+
+    A text file is memory-mapped and its lines are indexed by LineIndex in the background,
+    only the lines in the view are inserted into the widget, so large files open at once.
+    The search and the line number entry work on the indexed lines.
+    """
+
+    def __init__(self, parent: tk.Misc) -> None:
+        self.frame = ttk.Frame(parent)
+        self.frame.rowconfigure(0, weight=1)
+        self.frame.columnconfigure(0, weight=1)
+        self.index: Optional[LineIndex] = None
+        # number of the first line in the view
+        self.first_line = 0
+        # number of the line found by the last search or jump
+        self.found_line: Optional[int] = None
+        # id of the scheduled update during the indexing
+        self.poll_id: Optional[str] = None
+
+        self.text = tk.Text(self.frame, height=15, width=30, wrap="none")
+        self.text.grid(row=0, column=0, sticky="nsew")
+        self.text.tag_configure("found", background="yellow")
+        self.linespace = tkfont.Font(font=self.text['font']).metrics('linespace')
+
+        self.yscroll = ttk.Scrollbar(
+            self.frame, orient='vertical', command=self.yview)
+        self.text.config(yscrollcommand=self.text_yscroll)
+        self.yscroll.grid(row=0, column=1, sticky="nsew")
+
+        xscroll = ttk.Scrollbar(
+            self.frame, orient='horizontal', command=self.text.xview)
+        self.text.config(xscrollcommand=xscroll.set)
+        xscroll.grid(row=1, column=0, sticky="nsew")
+
+        search_frame = ttk.Frame(self.frame)
+        search_frame.grid(row=2, column=0, columnspan=2, sticky="we")
+        search_frame.columnconfigure(0, weight=1)
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(search_frame, textvariable=self.search_var)
+        search_entry.grid(row=0, column=0, sticky="we")
+        search_entry.bind("<Return>", lambda _: self.find_next())
+        ttk.Button(search_frame, text="Find", command=self.find_next).grid(
+            row=0, column=1)
+        ttk.Label(search_frame, text="Line").grid(row=0, column=2)
+        self.line_var = tk.StringVar()
+        line_entry = ttk.Entry(search_frame, textvariable=self.line_var, width=10)
+        line_entry.grid(row=0, column=3)
+        line_entry.bind("<Return>", lambda _: self.go_to_line())
+        ttk.Button(search_frame, text="Go", command=self.go_to_line).grid(
+            row=0, column=4)
+        self.status = ttk.Label(search_frame)
+        self.status.grid(row=1, column=0, columnspan=5, sticky="w")
+
+        self.text.bind("<Configure>", lambda _: self.render())
+        self.text.bind("<MouseWheel>", self.on_wheel)
+        self.text.bind("<Button-4>", self.on_wheel)
+        self.text.bind("<Button-5>", self.on_wheel)
+        self.text.bind("<Prior>", lambda _: self.scroll(-self.visible_lines()))
+        self.text.bind("<Next>", lambda _: self.scroll(self.visible_lines()))
+        self.grid = self.frame.grid
+
+    def clear(self) -> None:
+        """
+        Closes the previewed file and clears the text
+        """
+        if self.poll_id is not None:
+            self.frame.after_cancel(self.poll_id)
+            self.poll_id = None
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        self.found_line = None
+        self.status.configure(text="")
+        self.text.delete("1.0", "end")
+
+    def open(self, filename: str) -> None:
+        self.clear()
+        self.index = LineIndex(filename)
+        self.first_line = 0
+        self.poll()
+
+    def show_image(self, image: tk.PhotoImage) -> None:
+        self.clear()
+        self.text.image_create("1.0", image=image)
+
+    def show_message(self, message: str) -> None:
+        self.clear()
+        self.text.insert("1.0", message)
+
+    def poll(self) -> None:
+        """
+        Updates the view until the file is indexed
+        """
+        self.render()
+        if self.index is not None and not self.index.complete:
+            self.poll_id = self.frame.after(200, self.poll)
+        else:
+            self.poll_id = None
+
+    def visible_lines(self) -> int:
+        return max(self.text.winfo_height() // max(self.linespace, 1), 1)
+
+    def render(self) -> None:
+        """
+        Replaces the text with the lines in the view
+        """
+        if self.index is None:
+            return
+        line_count = self.index.line_count
+        visible = self.visible_lines()
+        self.first_line = max(min(self.first_line, line_count - visible), 0)
+        lines = self.index.lines(self.first_line, visible)
+        self.text.delete("1.0", "end")
+        self.text.insert("1.0", "\n".join(lines))
+        if self.found_line is not None and 0 <= self.found_line - self.first_line < len(lines):
+            row = self.found_line - self.first_line + 1
+            self.text.tag_add("found", f"{row}.0", f"{row}.end")
+        if line_count:
+            self.yscroll.set(self.first_line / line_count,
+                             min((self.first_line + visible) / line_count, 1.0))
+        else:
+            self.yscroll.set(0.0, 1.0)
+        status = f"Lines {self.first_line + 1}-{self.first_line + len(lines)} of {line_count}" if lines else "Empty file"
+        if not self.index.complete:
+            status += ", indexing..."
+        self.status.configure(text=status)
+
+    def text_yscroll(self, first: Union[str, float], last: Union[str, float]) -> None:
+        # the text widget contains only the view of an indexed file
+        if self.index is None:
+            self.yscroll.set(first, last)
+
+    def yview(self, *args: str) -> None:
+        if self.index is None:
+            self.text.yview(*args)
+            return
+        if args[0] == 'moveto':
+            self.first_line = int(float(args[1]) * self.index.line_count)
+            self.render()
+        elif args[0] == 'scroll':
+            self.scroll(int(args[1]) * (self.visible_lines()
+                                        if args[2] == 'pages' else 1))
+
+    def scroll(self, lines: int) -> Optional[str]:
+        if self.index is None:
+            return None
+        self.first_line += lines
+        self.render()
+        return "break"
+
+    def on_wheel(self, event: tk.Event) -> Optional[str]:
+        if event.num == 4:
+            direction = -1
+        elif event.num == 5:
+            direction = 1
+        else:
+            direction = -1 if event.delta > 0 else 1
+        return self.scroll(3 * direction)
+
+    def show_line(self, line: int) -> None:
+        """
+        Highlights the line and scrolls it into the middle of the view
+        """
+        self.found_line = line
+        self.first_line = line - self.visible_lines() // 2
+        self.render()
+
+    def find_next(self) -> None:
+        if self.index is None or not self.search_var.get():
+            return
+        start = self.found_line + 1 if self.found_line is not None else self.first_line
+        if start >= self.index.line_count:
+            start = 0
+        line = self.index.find(self.search_var.get(), start)
+        if line is None:
+            self.status.configure(text=f"'{self.search_var.get()}' is not found")
+        else:
+            self.show_line(line)
+
+    def go_to_line(self) -> None:
+        if self.index is None:
+            return
+        try:
+            line = int(self.line_var.get()) - 1
+        except ValueError:
+            self.status.configure(text="The line number is not a number")
+            return
+        if not 0 <= line < self.index.line_count:
+            self.status.configure(text=f"There are {self.index.line_count} lines" + (
+                "" if self.index.complete else " indexed so far"))
+            return
+        self.show_line(line)
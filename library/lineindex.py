@@ -0,0 +1,130 @@
+import mmap
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# lines longer than this are cut in LineIndex.lines
+MAX_LINE_LENGTH = 100000
+
+
+class LineIndex:
+    """
+    Offsets of the lines of a memory-mapped text file
+
+    The offsets are found in a background thread, block_size bytes at a time,
+    the lines in the part of the file that is already indexed can be read in the meantime.
+    close should be called to stop the thread and unmap the file.
+    """
+
+    def __init__(self, path: str, block_size: int = 1 << 22) -> None:
+        self.path = path
+        self.block_size = block_size
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        # empty files can't be mapped
+        self.data = mmap.mmap(self.file.fileno(), 0,
+                              access=mmap.ACCESS_READ) if self.size else None
+        # offsets of the starts of the lines, in blocks that are concatenated on demand
+        self.blocks: List[np.array] = [
+            np.zeros(1 if self.size else 0, dtype=np.int64)]
+        # number of bytes at the beginning of the file that are indexed
+        self.indexed = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._index_lines, daemon=True)
+        self.thread.start()
+
+    def _index_lines(self) -> None:
+        for offset in range(0, self.size, self.block_size):
+            if self.stop_event.is_set():
+                return
+            length = min(self.block_size, self.size - offset)
+            block = np.frombuffer(
+                self.data, dtype=np.uint8, count=length, offset=offset)  # type: ignore
+            starts = np.flatnonzero(block == ord('\n')) + (offset + 1)
+            del block
+            if offset + length == self.size and len(starts) and starts[-1] == self.size:
+                # there is no line after the final newline
+                starts = starts[:-1]
+            with self.lock:
+                self.blocks.append(starts)
+                self.indexed = offset + length
+
+    def close(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+
+    @property
+    def complete(self) -> bool:
+        return self.indexed == self.size
+
+    def starts(self) -> Tuple[np.array, int]:
+        """
+        Returns the offsets of the starts of the known lines and the number of indexed bytes
+        """
+        with self.lock:
+            if len(self.blocks) > 1:
+                self.blocks = [np.concatenate(self.blocks)]
+            return self.blocks[0], self.indexed
+
+    @property
+    def line_count(self) -> int:
+        """
+        Number of the known lines, it's the number of lines of the file, when the index is complete
+        """
+        return len(self.starts()[0])
+
+    def lines(self, first: int, count: int) -> List[str]:
+        """
+        Returns up to count known lines starting from the line number first, without the line endings
+        """
+        starts, _ = self.starts()
+        if self.data is None:
+            return []
+        lines = []
+        for start in starts[first:first + count].tolist():
+            end = self.data.find(b'\n', start, start + MAX_LINE_LENGTH)
+            if end < 0:
+                end = min(start + MAX_LINE_LENGTH, self.size)
+            lines.append(self.data[start:end].decode(
+                'utf-8', errors='replace').rstrip('\r'))
+        return lines
+
+    def line_of(self, offset: int) -> int:
+        """
+        Returns the number of the line containing the byte at offset.
+
+        The newlines after the indexed part of the file are counted directly
+        """
+        starts, indexed = self.starts()
+        if offset < indexed:
+            return int(np.searchsorted(starts, offset, side='right')) - 1
+        if offset == indexed:
+            return len(starts) - 1
+        assert self.data is not None
+        newlines = np.count_nonzero(np.frombuffer(
+            self.data, dtype=np.uint8, count=offset - indexed, offset=indexed) == ord('\n'))  # type: ignore
+        return len(starts) - 1 + int(newlines)
+
+    def find(self, text: str, line: int) -> Optional[int]:
+        """
+        Returns the number of the first line from the known line number line that contains text, continuing from the start of the file.
+
+        Returns None, if the text is not found
+        """
+        starts, _ = self.starts()
+        if self.data is None or not text or line >= len(starts):
+            return None
+        pattern = text.encode('utf-8')
+        start = int(starts[line])
+        position = self.data.find(pattern, start)
+        if position < 0:
+            position = self.data.find(pattern, 0, start + len(pattern) - 1)
+        if position < 0:
+            return None
+        return self.line_of(position)
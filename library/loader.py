@@ -0,0 +1,262 @@
+import bz2
+import gzip
+import hashlib
+import itertools
+import lzma
+import os
+import re
+import tempfile
+import warnings
+from array import array
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+import pandas as pd
+import numpy as np
+
+from library.seq import Seq, SEQ_DTYPE
+
+typos = dict(
+    specimen_voucher='specimenid',
+    specimen_id='specimenid',
+    sequences='sequence'
+)
+
+# functions that open the compressed input files by extension
+compressed_openers: Dict[str, Callable[..., TextIO]] = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+fasta_extensions = {'.fa', '.fas', '.fasta', '.fna', '.ffn', '.faa'}
+
+# default pattern for the fields of FASTA headers, like ">specimen|species" or ">specimen|species|marker|accession"
+DEFAULT_FASTA_HEADER = r"(?P<specimenid>[^|]*)\|(?P<species>[^|]*)(?:\|.*)?"
+
+
+class Haplotypes(Sequence[np.array]):
+    """
+    Sequences stored one after another in a single array, the i-th one is data[offsets[i]:offsets[i + 1]]
+
+    The sequences are views into data, which are created when accessed.
+    """
+
+    def __init__(self, data: np.array, offsets: Sequence[int]) -> None:
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.array:  # type: ignore[override]
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+
+class HaplotypeBuffer:
+    """
+    Collects encoded sequences into a single growable array of SEQ_DTYPE, storing each distinct sequence once
+
+    The i-th haplotype is buffer[offsets[i]:offsets[i + 1]].
+    Distinct sequences are recognized by a hash of their data, so the raw sequences are not kept.
+
+    If directory is given, the haplotypes are appended to a temporary file in it, which is memory-mapped at the end,
+    only their offsets and hashes are kept in memory.
+    """
+
+    def __init__(self, capacity: int = 1 << 20, directory: Optional[str] = None) -> None:
+        self.file = tempfile.TemporaryFile(
+            dir=directory) if directory is not None else None
+        self.buffer = np.empty(capacity if self.file is None else 0, dtype=SEQ_DTYPE)
+        self.size = 0
+        self.offsets = array('q', [0])
+        # haplotype of each added sequence
+        self.index = array('q')
+        self.unique: Dict[bytes, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def add(self, data: np.array) -> int:
+        """
+        Adds a sequence and returns the number of its haplotype
+        """
+        key = hashlib.blake2b(data.tobytes(), digest_size=16).digest()
+        i = self.unique.setdefault(key, len(self))
+        if i == len(self):
+            end = self.size + len(data)
+            if self.file is not None:
+                self.file.write(data.astype(SEQ_DTYPE, copy=False).tobytes())
+            elif end > len(self.buffer):
+                buffer = np.empty(max(end, 2 * len(self.buffer)), dtype=SEQ_DTYPE)
+                buffer[:self.size] = self.buffer[:self.size]
+                self.buffer = buffer
+            if self.file is None:
+                self.buffer[self.size:end] = data
+            self.size = end
+            self.offsets.append(end)
+        self.index.append(i)
+        return i
+
+    def haplotypes(self) -> Haplotypes:
+        """
+        Returns the haplotypes in the buffer, which is shrunk to its content or, if it's a file, memory-mapped
+        """
+        if self.file is not None:
+            self.file.flush()
+            if self.size:
+                self.buffer = np.memmap(self.file, dtype=SEQ_DTYPE, mode='r', shape=(self.size,))
+            self.file.close()
+        elif self.size < len(self.buffer):
+            self.buffer = self.buffer[:self.size].copy()
+        return Haplotypes(self.buffer, self.offsets)
+
+    def haplotype_index(self) -> np.array:
+        return np.frombuffer(self.index, dtype=np.int64).copy()
+
+
+def _check_columns(chunk: pd.DataFrame) -> None:
+    if 'sequence' not in chunk.columns:
+        raise ValueError("'sequences' or 'sequence' column is missing")
+    if 'specimenid' not in chunk.columns:
+        warnings.warn("Specimen IDs are not detected")
+    if len(chunk.columns) < 2 + ('specimenid' in chunk.columns):
+        raise ValueError("'species' or another column need to be present")
+
+
+def infer_types(table: pd.DataFrame) -> None:
+    """
+    Converts the columns of a table read as text into numbers, if all their values are numbers.
+
+    Applied to the whole table, it gives each column one type, as if the file was read at once
+    """
+    for column in table.columns:
+        try:
+            table[column] = pd.to_numeric(table[column])
+        except (ValueError, TypeError):
+            pass
+
+
+def read_chunks(chunks: Iterable[pd.DataFrame], parse: Callable[[str], Seq], progress: Optional[Callable[[int], None]] = None,
+                directory: Optional[str] = None) -> Tuple[pd.DataFrame, Haplotypes, np.array]:
+    """
+    Encodes the sequences of the chunks of a table with parse into a HaplotypeBuffer, which is stored in directory, if it's given.
+
+    Returns the metadata columns, the haplotypes and the index of the haplotype of each row.
+    The text of the sequences is dropped together with its chunk.
+
+    progress is called with the number of rows read after each chunk
+    """
+    buffer = HaplotypeBuffer(directory=directory)
+    tables: List[pd.DataFrame] = []
+    for chunk in chunks:
+        chunk = chunk.rename(columns=str.casefold).rename(columns=typos)
+        if not tables:
+            _check_columns(chunk)
+        for sequence in chunk.pop('sequence'):
+            buffer.add(parse(sequence).data)
+        tables.append(chunk)
+        if progress is not None:
+            progress(len(buffer.index))
+    if not tables:
+        raise ValueError("The input file is empty")
+    table = pd.concat(tables) if len(tables) > 1 else tables[0]
+    return table, buffer.haplotypes(), buffer.haplotype_index()
+
+
+def open_input(infile: str) -> TextIO:
+    """
+    Opens the input file as text, decompressing it on the fly if it has the extension of a compressed file
+    """
+    _, ext = os.path.splitext(infile)
+    opener = compressed_openers.get(ext.lower(), open)
+    return opener(infile, mode='rt', errors='replace')
+
+
+def is_fasta(infile: str) -> bool:
+    """
+    Detects FASTA files by the extension or, if it's not known, by the first character
+    """
+    name, ext = os.path.splitext(infile)
+    if ext.lower() in compressed_openers:
+        _, ext = os.path.splitext(name)
+    if ext.lower() in fasta_extensions:
+        return True
+    with open_input(infile) as file:
+        return file.read(1) == '>'
+
+
+def fasta_records(file: TextIO) -> Iterator[Tuple[str, str]]:
+    """
+    Yields the headers (without '>') and the sequences of a FASTA file
+    """
+    header = None
+    lines: List[str] = []
+    for line in file:
+        line = line.strip()
+        if line.startswith('>'):
+            if header is not None:
+                yield header, "".join(lines)
+            header = line[1:]
+            lines = []
+        elif header is None:
+            if line:
+                raise ValueError("The FASTA file should start with a '>' header")
+        else:
+            lines.append(line)
+    if header is not None:
+        yield header, "".join(lines)
+
+
+def fasta_chunks(file: TextIO, header_pattern: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Yields the records of a FASTA file as tables of chunk_size rows.
+
+    The columns are the named groups of header_pattern, which should match each whole header,
+    and the sequence
+    """
+    regex = re.compile(header_pattern)
+    fields = list(regex.groupindex)
+    records = fasta_records(file)
+    while True:
+        rows = []
+        for header, sequence in itertools.islice(records, chunk_size):
+            match = regex.fullmatch(header)
+            if not match:
+                raise ValueError(
+                    f"The FASTA header '{header}' doesn't match the pattern '{header_pattern}'")
+            rows.append([match.group(name) for name in fields] + [sequence])
+        if not rows:
+            return
+        yield pd.DataFrame(rows, columns=fields + ['sequence'])
+
+
+def read_table(infile: str, aligned: bool = False, chunk_size: int = 10000, header_pattern: str = DEFAULT_FASTA_HEADER,
+               progress: Optional[Callable[[int], None]] = None, directory: Optional[str] = None) -> Tuple[pd.DataFrame, Haplotypes, np.array]:
+    """
+    Reads a tab-file or a FASTA file of sequences in chunks of chunk_size rows, see read_chunks.
+
+    Files with the extension .gz, .bz2 or .xz are decompressed while reading.
+    The columns of a FASTA file are parsed from the headers with header_pattern, see fasta_chunks.
+
+    The sequences are trimmed, unless aligned is set.
+    The columns of a tab-file are read as text in each chunk, and their types are inferred for the whole table.
+    The table is indexed by the specimen IDs, if present.
+    If directory is given, the haplotypes are stored in a memory-mapped temporary file in it
+    """
+    fasta = is_fasta(infile)
+    with open_input(infile) as file:
+        if fasta:
+            chunks: Iterable[pd.DataFrame] = fasta_chunks(
+                file, header_pattern, chunk_size)
+        else:
+            chunks = pd.read_csv(file, delimiter='\t',
+                                 chunksize=chunk_size, dtype=str)
+        table, haplotypes, index = read_chunks(
+            chunks, Seq.from_str_notrim if aligned else Seq.from_str, progress, directory)
+    if not fasta:
+        infer_types(table)
+    if 'specimenid' in table.columns:
+        table.set_index('specimenid', inplace=True)
+    return table, haplotypes, index
@@ -0,0 +1,112 @@
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None  # type: ignore
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Returns the peak resident memory of the process in bytes, if it's known
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RunProfile:
+    """
+    Records the wall time, the number of processed items and the peak memory of the stages of a run
+
+    If detailed, the run is profiled with cProfile and the memory is traced with tracemalloc,
+    which gives the peak of the traced memory during each stage.
+    The profiling is active inside the `with` block of the RunProfile.
+    """
+
+    def __init__(self, detailed: bool = False) -> None:
+        self.detailed = detailed
+        self.stages: List[Dict[str, Any]] = []
+        self.profiler: Optional[cProfile.Profile] = None
+        self.started_tracing = False
+        self.start = 0.0
+        self.wall_time = 0.0
+        # inside the `with` block
+        self.active = False
+
+    def __enter__(self) -> 'RunProfile':
+        self.active = True
+        self.start = time.perf_counter()
+        if self.detailed:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        self.wall_time = time.perf_counter() - self.start
+        self.active = False
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        Records the stage executed in the `with` block.
+
+        The yielded record can be updated, for example with the number of items, when it's known at the end
+        """
+        record: Dict[str, Any] = dict(name=name, items=items)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_time'] = time.perf_counter() - start
+            if tracing:
+                record['peak_traced_memory'] = tracemalloc.get_traced_memory()[1]
+            record['peak_rss'] = peak_rss()
+            self.stages.append(record)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(wall_time=self.wall_time, peak_rss=peak_rss(), stages=self.stages)
+
+    def write(self, path: str) -> None:
+        """
+        Writes the profile as JSON into path + ".json" and, if it's detailed, the cProfile statistics into path + ".prof"
+
+        The statistics can be read with pstats
+        """
+        with open(path + ".json", mode="w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+        if self.profiler is not None:
+            self.profiler.dump_stats(path + ".prof")
+
+    def summary(self, limit: int = 20) -> str:
+        """
+        Returns the functions with the largest cumulative time, if the profile is detailed
+        """
+        if self.profiler is None:
+            return ""
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output).sort_stats(
+            'cumulative').print_stats(limit)
+        return output.getvalue()
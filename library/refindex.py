@@ -0,0 +1,78 @@
+from typing import List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from library.seq import Seq
+from library.fastalign import kmers
+
+# score in ReferencePanelIndex.rank, below which the sequences are considered unrelated to a reference
+MIN_REFERENCE_SCORE = 0.1
+
+
+def sample_indices(length: int, sample: Optional[int]) -> List[int]:
+    """
+    Returns up to sample evenly spaced indices into a sequence of the given length, all indices if sample is None
+    """
+    if sample is None or length <= sample:
+        return list(range(length))
+    return np.linspace(0, length - 1, sample).astype(np.int64).tolist()
+
+
+class ReferencePanelIndex:
+    """
+    Inverted index from the k-mers of a panel of reference sequences to the references containing them
+
+    The distinct k-mers of all references are kept in one sorted array with the numbers of their references,
+    so that the k-mers of a sequence are looked up with a binary search independently of the number of references.
+    """
+
+    def __init__(self, references: Mapping[str, Seq], k: int = 10) -> None:
+        self.k = k
+        self.names = list(references)
+        codes = []
+        owners = []
+        for number, reference in enumerate(references.values()):
+            reference_codes = np.unique(kmers(reference.data, k)[0])
+            codes.append(reference_codes)
+            owners.append(np.full(len(reference_codes), number, dtype=np.int32))
+        all_codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.int64)
+        order = np.argsort(all_codes, kind='stable')
+        self.codes = all_codes[order]
+        self.owners = np.concatenate(owners)[order] if owners else np.zeros(0, dtype=np.int32)
+
+    def containment(self, sequences: Sequence[np.array]) -> np.array:
+        """
+        Returns the array of shape (len(sequences), number of references),
+        whose elements are the fractions of the distinct k-mers of each sequence that occur in each reference.
+
+        The rows of sequences without k-mers are zero
+        """
+        query_codes = [np.unique(kmers(data, self.k)[0]) for data in sequences]
+        counts = np.array([len(codes) for codes in query_codes], dtype=np.int64)
+        codes = np.concatenate(query_codes) if query_codes else np.zeros(0, dtype=np.int64)
+        queries = np.repeat(np.arange(len(sequences)), counts)
+        starts = np.searchsorted(self.codes, codes, side='left')
+        hits = np.searchsorted(self.codes, codes, side='right') - starts
+        # positions in self.codes of all hits, the ranges starts[i]:starts[i] + hits[i] one after another
+        hit_offsets = np.cumsum(hits) - hits
+        positions = np.arange(hits.sum()) - np.repeat(hit_offsets - starts, hits)
+        shared = np.bincount(np.repeat(queries, hits) * len(self.names) + self.owners[positions],
+                             minlength=len(sequences) * len(self.names)).reshape(len(sequences), len(self.names))
+        return shared / np.maximum(counts, 1)[:, np.newaxis]
+
+    def rank(self, sequences: Sequence[np.array], sample: Optional[int] = 200) -> List[Tuple[str, float]]:
+        """
+        Returns the names of the references with their mean containment in a sample of the sequences, best first.
+
+        The sample consists of the sequences at sample_indices(len(sequences), sample).
+        The sequences that share no k-mers with any reference are ignored
+        """
+        containment = self.containment(
+            [sequences[i] for i in sample_indices(len(sequences), sample)])
+        informative = containment.any(axis=1)
+        if informative.any():
+            scores = containment[informative].mean(axis=0)
+        else:
+            scores = np.zeros(len(self.names))
+        order = np.argsort(-scores, kind='stable')
+        return [(self.names[i], float(scores[i])) for i in order.tolist()]
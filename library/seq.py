@@ -1,38 +1,17 @@
-from typing import Union, Iterator, Tuple, Dict, List, Optional, cast
+from typing import Iterator, Tuple, Dict, List, Optional
 import numpy as np
 from functools import reduce
-from Bio.Align import PairwiseAligner
-import itertools
-import os
+from Bio.Align import Alignment
 import re
 
-with open(os.path.join('data', 'scores.tab')) as scores_file:
-    scores_dict = {}
-    for line in scores_file:
-        score_name, _, val = line.partition('\t')
-        try:
-            scores_dict[score_name] = int(val)
-        except ValueError as ex:
-            raise ValueError(
-                f"The value for '{score_name}' in data/scores.tab is not a number") from ex
-
-try:
-    GAP_PENALTY = scores_dict['gap penalty']
-    GAP_EXTEND_PENALTY = scores_dict['gap extend penalty']
-    END_GAP_PENALTY = scores_dict['end gap penalty']
-    END_GAP_EXTEND_PENALTY = scores_dict['end gap extend penalty']
-    MATCH_SCORE = scores_dict['match score']
-    MISMATCH_SCORE = scores_dict['mismatch score']
-except KeyError as ex:
-    raise ValueError(f"'{ex.args[0]}' is missing in data/scores.tab") from ex
+from library.config import Config, default_config
 
-score_matrix = np.empty((16, 16))
 
-for i, j in itertools.product(range(0, 16), range(0, 16)):
-    score_matrix[i, j] = MATCH_SCORE if i & j else MISMATCH_SCORE
-
-aligner = PairwiseAligner(substitution_matrix=score_matrix, end_open_gap_score=END_GAP_PENALTY,
-                          end_extend_gap_score=END_GAP_EXTEND_PENALTY, internal_open_gap_score=GAP_PENALTY, internal_extend_gap_score=GAP_EXTEND_PENALTY)
+def aligner_input(data: np.array) -> np.array:
+    """
+    PairwiseAligner only accepts arrays of 32-bit integers
+    """
+    return data.astype(np.int32)
 
 seq_read_dict = {
     '-':0,
@@ -82,11 +61,91 @@ seq_write_tuple = tuple(char for char,
                                  _ in sorted(seq_read_dict.items(), key=lambda x: x[1]))
 
 
+# dtype of the encoded sequences
+SEQ_DTYPE = np.uint8
+
+# code in seq_read_table for unexpected characters
+UNEXPECTED_CODE = 0xFF
+
+# maps a byte of the input to its nucleotide code
+seq_read_table = np.full(256, UNEXPECTED_CODE, dtype=SEQ_DTYPE)
+for char, code in seq_read_dict.items():
+    seq_read_table[ord(char)] = code
+    seq_read_table[ord(char.lower())] = code
+
+# characters that are stripped from the ends of a sequence by Seq.from_str
+seq_trim_table = np.zeros(256, dtype=bool)
+seq_trim_table[list(b"-Nn?\n\t ")] = True
+
+
+def _raw_bytes(sequence: str) -> np.array:
+    """
+    Returns the characters of sequence as an array of bytes.
+
+    Non-ASCII characters are replaced by 0xFF, which is not a nucleotide.
+    """
+    try:
+        return np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)
+    except UnicodeEncodeError:
+        return np.minimum(np.frombuffer(sequence.encode('utf-32-le'), dtype=np.uint32), 0xFF).astype(np.uint8)
+
+
+def _encode(raw: np.array, sequence: str, offset: int = 0) -> np.array:
+    """
+    Encodes the bytes of sequence[offset:] into nucleotide codes
+    """
+    data = seq_read_table[raw]
+    unexpected = np.flatnonzero(data == UNEXPECTED_CODE)
+    if len(unexpected):
+        i = int(unexpected[0]) + offset
+        raise ValueError(
+            f"Unexpected nucleotide: {sequence[i]} at position {i}")
+    return data
+
+
+# maps a nucleotide code to its character
+seq_write_table = np.frombuffer("".join(seq_write_tuple).encode('ascii'), dtype=np.uint8)
+
+# maps a packed byte to the characters of its two nucleotide codes
+seq_write_pair_table = np.stack(
+    (seq_write_table[np.arange(256) & 0x0F], seq_write_table[np.arange(256) >> 4]), axis=1)
+
+
+def pack_codes(data: np.array) -> np.array:
+    """
+    Packs nucleotide codes two per byte.
+
+    The code at an even position goes into the lower 4 bits, the code at the next position into the upper 4 bits.
+    An odd-length sequence is padded with a gap.
+    Also packs each row of a 2D array
+    """
+    if data.shape[-1] % 2:
+        data = np.concatenate(
+            (data, np.zeros(data.shape[:-1] + (1,), dtype=SEQ_DTYPE)), axis=-1)
+    return data[..., 0::2] | (data[..., 1::2] << 4)
+
+
+def unpack_codes(packed: np.array, length: int) -> np.array:
+    """
+    Inverse of pack_codes
+
+    Also unpacks each row of a 2D array
+    """
+    data = np.empty(packed.shape[:-1] + (2 * packed.shape[-1],), dtype=SEQ_DTYPE)
+    data[..., 0::2] = packed & 0x0F
+    data[..., 1::2] = packed >> 4
+    return data[..., :length]
+
+
+def decode(data: np.array) -> str:
+    return seq_write_table[data].tobytes().decode('ascii')
+
+
 def np_or_maxlen(arr1: np.array, arr2: np.array) -> np.array:
     if len(arr1) < len(arr2):
-        arr1.resize(len(arr2))
+        arr1 = np.concatenate((arr1, np.zeros(len(arr2) - len(arr1), dtype=arr1.dtype)))
     elif len(arr2) < len(arr1):
-        arr2.resize(len(arr1))
+        arr2 = np.concatenate((arr2, np.zeros(len(arr1) - len(arr2), dtype=arr2.dtype)))
     return arr1 | arr2
 
 
@@ -97,9 +156,102 @@ def merge_insertions(ins1: Dict[int, np.array], ins2: Dict[int, np.array]) -> Di
     return result
 
 
+def align_coordinates(data: np.array, ref_data: np.array, config: Optional[Config] = None) -> np.array:
+    """
+    Returns the coordinates of the best alignment of data with ref_data with the aligner of config or default_config().
+
+    The coordinates are an array of shape (2, k) like Bio.Align.Alignment.coordinates, the first row is for ref_data.
+    """
+    aligner = (config or default_config()).aligner
+    return aligner.align(aligner_input(ref_data), aligner_input(data))[0].coordinates
+
+
+def apply_alignment(data: np.array, ref_data: np.array, coordinates: np.array) -> Tuple[np.array, Dict[int, np.array], int, int]:
+    """
+    Returns the aligned data with the same length as ref_data, the insertions relative to ref_data
+    and the start and end of the content in the aligned data
+    """
+    steps = np.diff(coordinates, axis=1)
+    blocks = np.flatnonzero((steps[0] > 0) & (steps[1] > 0))
+    aligned_data = np.zeros(len(ref_data), dtype=SEQ_DTYPE)
+    insertions = {}
+    prev_self_end = 0
+    prev_ref_end = 0
+    for k in blocks:
+        ref_start, ref_end = coordinates[0, k:k + 2]
+        self_start, self_end = coordinates[1, k:k + 2]
+        aligned_data[ref_start:ref_end] = data[self_start:self_end]
+        if self_start > prev_self_end:
+            insertions[prev_ref_end] = data[prev_self_end: self_start]
+        prev_self_end = self_end
+        prev_ref_end = ref_end
+    else:
+        if prev_self_end < len(data):
+            insertions[prev_ref_end] = data[prev_self_end:]
+    start = coordinates[0, blocks[0]]
+    end = coordinates[0, blocks[-1] + 1]
+    return aligned_data, insertions, int(start), int(end)
+
+
+def format_alignment(data: np.array, ref_data: np.array, coordinates: np.array) -> str:
+    """
+    Returns the display of the alignment
+    """
+    return format(Alignment([decode(ref_data), decode(data)], coordinates))
+
+
+class PositionTranslator:
+    """
+    Translates positions in a sequence into labels of positions relative to a reference
+
+    The position i is labeled as str(positions[i]) if offsets[i] == 0
+    and as f"{positions[i]}+{offsets[i]}" otherwise, which represents an insertion.
+    """
+
+    def __init__(self, positions: np.array, offsets: np.array) -> None:
+        self.positions = positions
+        self.offsets = offsets
+
+    @classmethod
+    def identity(cls, length: int) -> 'PositionTranslator':
+        """
+        Translator for a sequence that is already in the coordinates of the reference
+        """
+        return cls(np.arange(length), np.zeros(length, dtype=np.int64))
+
+    @classmethod
+    def from_coordinates(cls, coordinates: np.array, length: int) -> 'PositionTranslator':
+        """
+        Translator for a sequence of the given length from the coordinates of its alignment with the reference.
+
+        A position in an aligned block is labeled by itself,
+        other positions are labeled as insertions after the last position in an aligned block.
+        """
+        steps = np.diff(coordinates, axis=1)
+        aligned = np.zeros(length, dtype=bool)
+        for k in np.flatnonzero((steps[0] > 0) & (steps[1] > 0)):
+            aligned[coordinates[1, k]:coordinates[1, k + 1]] = True
+        indices = np.arange(length)
+        last_aligned = np.maximum.accumulate(np.where(aligned, indices, -1))
+        positions = np.maximum(last_aligned, 0)
+        offsets = np.where(aligned, 0, np.where(
+            last_aligned >= 0, indices - last_aligned, indices + 1))
+        return cls(positions, offsets)
+
+    def __call__(self, i: int) -> str:
+        offset = self.offsets[i]
+        if offset:
+            return f"{self.positions[i]}+{offset}"
+        else:
+            return str(self.positions[i])
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+
 class Seq:
     """
-    Store a sequence in a compact way as np.array of bytes
+    Store a sequence in a compact way as np.array of bytes (SEQ_DTYPE)
 
     Each byte encodes a set of nucleotides into the 4 lower bits with correspondences:
     A <~> 0b0001
@@ -113,37 +265,32 @@ class Seq:
         self.insertions = insertions
         # actual data is self.data[self.start:self.end]
         self.start = 0
-        self.end = len(self.data)
+        self.end = len(data)
 
     @classmethod
     def from_str(cls, sequence: str) -> 'Seq':
-        sequence = sequence.strip("-Nn?\n\t ").upper()
-        seq: Seq = cls(np.empty(len(sequence), dtype="int32"), {})
-        for i, el in enumerate(map(seq_read_dict.get, sequence)):
-            try:
-                seq.data[i] = el
-            except TypeError as ex:
-                raise ValueError(
-                    f"Unexpected nucleotide: {sequence[i]}") from ex
-        return seq
+        raw = _raw_bytes(sequence)
+        content = np.flatnonzero(~seq_trim_table[raw])
+        if not len(content):
+            return cls(np.empty(0, dtype=SEQ_DTYPE), {})
+        offset = int(content[0])
+        return cls(_encode(raw[offset:content[-1] + 1], sequence, offset), {})
 
     @classmethod
     def from_str_notrim(cls, sequence: str) -> 'Seq':
-        sequence = sequence.upper()
-        seq: Seq = cls(np.empty(len(sequence), dtype="int32"), {})
-        for i, el in enumerate(map(seq_read_dict.get, sequence)):
-            try:
-                seq.data[i] = el
-                # Calculate start and end of the sequence content
-                if el == 0 and i == seq.start:
-                    seq.start += 1
-                if el != 0:
-                    seq.end = i + 1
-            except TypeError as ex:
-                raise ValueError(
-                    f"Unexpected nucleotide: {sequence[i]}") from ex
-        return seq
+        return cls.from_data_notrim(_encode(_raw_bytes(sequence), sequence))
 
+    @classmethod
+    def from_data_notrim(cls, data: np.array) -> 'Seq':
+        seq: Seq = cls(data, {})
+        # Calculate start and end of the sequence content
+        content = np.flatnonzero(data)
+        if len(content):
+            seq.start = int(content[0])
+            seq.end = int(content[-1]) + 1
+        else:
+            seq.start = len(data)
+        return seq
 
     def __or__(self, other: 'Seq') -> 'Seq':
         result = Seq(self.data | other.data, merge_insertions(
@@ -153,75 +300,122 @@ class Seq:
         return result
 
     def __str__(self) -> str:
-        return "".join(map(seq_write_tuple.__getitem__, self.data))
+        return decode(self.data)
 
     def __iter__(self) -> Iterator:
         return self.data.__iter__()
 
-    def align(self, ref: 'Seq') -> str:
-        alignment = aligner.align(ref.data, self.data)[0]
-        aligned = alignment.aligned
-        alignment.target = "".join(
-            map(seq_write_tuple.__getitem__, alignment.target))
-        alignment.query = "".join(
-            map(seq_write_tuple.__getitem__, alignment.query))
-        aligned_data = np.zeros_like(ref.data)
-        self.insertions = {}
-        prev_self_end = 0
-        prev_ref_end = 0
-        for (ref_start, ref_end), (self_start, self_end) in zip(*aligned):
-            aligned_data[ref_start:ref_end] = self.data[self_start:self_end]
-            if self_start > prev_self_end:
-                self.insertions[prev_ref_end] = self.data[prev_self_end: self_start]
-            prev_self_end = self_end
-            prev_ref_end = ref_end
-        else:
-            if prev_self_end < len(self.data):
-                self.insertions[prev_ref_end] = self.data[prev_self_end:]
-        self.start, _ = aligned[0][0]
-        _, self.end = aligned[0][-1]
-        self.data = aligned_data
-        return format(alignment)
-
-    def make_position_tranlator(self, ref: 'Seq') -> Tuple[str, ...]:
+    def make_position_tranlator(self, ref: 'Seq', config: Optional[Config] = None) -> 'PositionTranslator':
         """
-        Returns a tuple, which at position i contains of a position of ref corresponding to the position i in self.
+        Returns the translator of positions in self, based on the alignment of self with ref.
         "n+i" represents insertion relative to ref
         """
-        translator: List[Optional[Union[int, str]]] = [None] * len(self.data)
-        aligned = aligner.align(ref.data, self.data)[0].aligned
-        for _, self_frag in zip(*aligned):
-            translator[slice(*self_frag)] = range(*self_frag)
-        last_index_to = 0
-        shift_from_last = 1
-        for i, to in enumerate(translator):
-            if to is not None:
-                translator[i] = str(to)
-                last_index_to = i
-                shift_from_last = 1
-            else:
-                translator[i] = f"{last_index_to}+{shift_from_last}"
-                shift_from_last += 1
-        return cast(Tuple[str, ...], tuple(translator))
-
-    def reset_insertions(self) -> None:
-        self.insertions = {}
-
-
-def differences(seq1: Seq, seq2: Seq) -> Tuple[List[Tuple[int, int, int]], Dict[int, np.array], Dict[int, np.array]]:
-    """
-    Returns a list of (index, nucleotide1, nucleotide2) of different nucleotides.
+        return PositionTranslator.from_coordinates(align_coordinates(self.data, ref.data, config), len(self.data))
+
+
+class PackedSeq(Seq):
+    """
+    Seq that stores two nucleotide codes per byte, see pack_codes
+
+    Reading self.data unpacks the whole sequence, so the operations used during the comparison work on self.packed directly.
+    """
+
+    @property  # type: ignore[override]
+    def data(self) -> np.array:
+        return unpack_codes(self.packed, self.length)
+
+    @data.setter
+    def data(self, data: np.array) -> None:
+        self.packed = pack_codes(data)
+        self.length = len(data)
+
+    @classmethod
+    def from_packed(cls, packed: np.array, length: int, insertions: Dict[int, np.array]) -> 'PackedSeq':
+        seq = cls.__new__(cls)
+        seq.packed = packed
+        seq.length = length
+        seq.insertions = insertions
+        seq.start = 0
+        seq.end = length
+        return seq
+
+    def __or__(self, other: Seq) -> Seq:
+        if not isinstance(other, PackedSeq):
+            return super().__or__(other)
+        if self.length != other.length:
+            raise ValueError(
+                f"Cannot combine sequences of lengths {self.length} and {other.length}")
+        result = PackedSeq.from_packed(self.packed | other.packed, self.length, merge_insertions(
+            self.insertions, other.insertions))
+        result.start = min(self.start, other.start)
+        result.end = max(self.end, other.end)
+        return result
+
+    def __str__(self) -> str:
+        return seq_write_pair_table[self.packed].tobytes()[:self.length].decode('ascii')
+
+
+class Replacements:
+    """
+    Positions of different nucleotides in two sequences as arrays
+
+    nucs1[k] and nucs2[k] are the nucleotides of each sequence at the position indices[k]
+    """
+
+    def __init__(self, indices: np.array, nucs1: np.array, nucs2: np.array) -> None:
+        self.indices = indices
+        self.nucs1 = nucs1
+        self.nucs2 = nucs2
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, int]]:
+        return zip(self.indices.tolist(), self.nucs1.tolist(), self.nucs2.tolist())
+
+
+def packed_replacements(seq1: PackedSeq, seq2: PackedSeq, diff_start: int, diff_end: int) -> Replacements:
+    """
+    Replacements of differences for two packed sequences of the same length
+
+    Only the positions of the different nucleotides are unpacked
+    """
+    byte_start = diff_start // 2
+    byte_end = (diff_end + 1) // 2
+    packed1 = seq1.packed[byte_start:byte_end]
+    packed2 = seq2.packed[byte_start:byte_end]
+    common = packed1 & packed2
+    union = packed1 | packed2
+    different = np.empty(2 * len(common), dtype=bool)
+    different[0::2] = ((common & 0x0F) == 0) & ((union & 0x0F) != 0)
+    different[1::2] = ((common & 0xF0) == 0) & ((union & 0xF0) != 0)
+    indices = np.flatnonzero(different) + 2 * byte_start
+    indices = indices[(indices >= diff_start) & (indices < diff_end)]
+    shifts = (indices % 2) * 4
+    nucs1 = (seq1.packed[indices // 2] >> shifts) & 0x0F
+    nucs2 = (seq2.packed[indices // 2] >> shifts) & 0x0F
+    return Replacements(indices, nucs1, nucs2)
+
+
+def differences(seq1: Seq, seq2: Seq) -> Tuple[Replacements, Dict[int, np.array], Dict[int, np.array]]:
+    """
+    Returns the replacements of different nucleotides.
 
     Additionally returns a pair of dictionaries for different insertions for each sequence
     """
     # only compare common segments
     diff_start = max(seq1.start, seq2.start)
     diff_end = min(seq1.end, seq2.end)
-    seq1_segment = seq1.data[diff_start:diff_end]
-    seq2_segment = seq2.data[diff_start:diff_end]
-
-    replacements = [(i + diff_start, nuc1, nuc2) for i, (nuc1, nuc2) in enumerate(
-        zip(seq1_segment, seq2_segment)) if not nuc1 & nuc2 and (nuc1 or nuc2)]
+    if isinstance(seq1, PackedSeq) and isinstance(seq2, PackedSeq) and seq1.length == seq2.length:
+        replacements = packed_replacements(seq1, seq2, diff_start, diff_end)
+    else:
+        seq1_segment = seq1.data[diff_start:diff_end]
+        seq2_segment = seq2.data[diff_start:diff_end]
+        different = ((seq1_segment & seq2_segment) == 0) & (
+            (seq1_segment | seq2_segment) != 0)
+        indices = np.flatnonzero(different)
+        replacements = Replacements(
+            indices + diff_start, seq1_segment[indices], seq2_segment[indices])
 
     ins1 = seq1.insertions
     ins2 = seq2.insertions
@@ -0,0 +1,407 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Iterator, cast
+from functools import reduce
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import tempfile
+
+import numpy as np
+
+from library.seq import Seq, PackedSeq, SEQ_DTYPE, merge_insertions, pack_codes, unpack_codes, align_coordinates, apply_alignment, format_alignment
+from library.aligncache import AlignmentCache
+from library.fastalign import FastAligner
+from library.config import Config
+
+
+class SequenceMatrix:
+    """
+    Stores aligned sequences of the same length as rows of a single 2D array of SEQ_DTYPE
+
+    The content of the i-th sequence is in the columns starts[i]:ends[i].
+    Insertions are stored in a side table, which maps a row to its insertions. Rows without insertions are absent.
+
+    If packed, each row is packed with pack_codes and the matrix has (width + 1) // 2 columns.
+
+    The arrays can be memory-mapped files (np.memmap), then combine reads the matrix in blocks of rows.
+    """
+
+    def __init__(self, data: np.array, starts: np.array, ends: np.array, insertions: Dict[int, Dict[int, np.array]], width: int, packed: bool = False) -> None:
+        self.data = data
+        self.starts = starts
+        self.ends = ends
+        self.insertions = insertions
+        self.width = width
+        self.packed = packed
+
+    @classmethod
+    def empty(cls, rows: int, width: int, packed: bool = False, directory: Optional[str] = None) -> 'SequenceMatrix':
+        """
+        Returns the matrix of empty sequences.
+
+        If directory is given, the arrays are memory-mapped temporary files in it
+        """
+        columns = (width + 1) // 2 if packed else width
+        return cls(_zeros((rows, columns), SEQ_DTYPE, directory), _zeros((rows,), np.int64, directory), _zeros((rows,), np.int64, directory), {}, width, packed)
+
+    @classmethod
+    def from_seqs(cls, seqs: Sequence[Seq], packed: bool = False, directory: Optional[str] = None) -> 'SequenceMatrix':
+        """
+        Collects sequences that are already aligned
+        """
+        widths = {len(seq.data) for seq in seqs}
+        if len(widths) > 1:
+            raise ValueError("The sequences seem to not be aligned")
+        matrix = cls.empty(len(seqs), widths.pop() if widths else 0, packed, directory)
+        for i, seq in enumerate(seqs):
+            matrix.set_row(i, seq.data, seq.insertions, seq.start, seq.end)
+        return matrix
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def set_row(self, i: int, data: np.array, insertions: Dict[int, np.array], start: int, end: int) -> None:
+        self.data[i] = pack_codes(data) if self.packed else data
+        self.starts[i] = start
+        self.ends[i] = end
+        if insertions:
+            self.insertions[i] = insertions
+        else:
+            self.insertions.pop(i, None)
+
+    def row(self, i: int) -> Seq:
+        """
+        Returns the i-th sequence. Its data is a view into the matrix
+        """
+        insertions = self.insertions.get(i, {})
+        if self.packed:
+            seq: Seq = PackedSeq.from_packed(self.data[i], self.width, insertions)
+        else:
+            seq = Seq(self.data[i], insertions)
+        seq.start = int(self.starts[i])
+        seq.end = int(self.ends[i])
+        return seq
+
+    def codes(self, rows: slice) -> np.array:
+        """
+        Returns the nucleotide codes of the rows, unpacking them if the matrix is packed
+        """
+        if self.packed:
+            return unpack_codes(self.data[rows], self.width)
+        else:
+            return self.data[rows]
+
+    def __iter__(self) -> Iterator[Seq]:
+        return (self.row(i) for i in range(len(self)))
+
+    def without_insertions(self) -> 'SequenceMatrix':
+        """
+        Returns the matrix with the same data and no insertions
+        """
+        return SequenceMatrix(self.data, self.starts, self.ends, {}, self.width, self.packed)
+
+    def take(self, rows: Sequence[int]) -> 'SequenceMatrix':
+        """
+        Returns the matrix of the given rows
+        """
+        indices = np.asarray(rows, dtype=np.int64)
+        insertions = {new: self.insertions[old] for new, old in enumerate(
+            indices.tolist()) if old in self.insertions}
+        return SequenceMatrix(self.data[indices], self.starts[indices], self.ends[indices], insertions, self.width, self.packed)
+
+    def _union_insertions(self, rows: np.array) -> Dict[int, np.array]:
+        return reduce(merge_insertions, (self.insertions[row]
+                                         for row in rows.tolist() if row in self.insertions), {})
+
+    def _union(self, rows: np.array) -> Tuple[np.array, int, int, Dict[int, np.array]]:
+        if not len(rows):
+            return np.zeros(self.data.shape[1], dtype=SEQ_DTYPE), 0, 0, {}
+        insertions = self._union_insertions(rows)
+        return np.bitwise_or.reduce(self.data[rows], axis=0), int(self.starts[rows].min()), int(self.ends[rows].max()), insertions
+
+    def union_of_others(self) -> 'SequenceMatrix':
+        """
+        Returns the matrix, whose i-th row combines all rows except the i-th one, like reducing them with Seq.__or__
+
+        It is computed from prefix and suffix unions in linear time.
+        """
+        n = len(self)
+        result = SequenceMatrix.empty(n, self.width, self.packed)
+        if n < 2:
+            return result
+        np.bitwise_or.accumulate(self.data[:-1], axis=0, out=result.data[1:])
+        result.data[:-1] |= np.bitwise_or.accumulate(
+            self.data[:0:-1], axis=0)[::-1]
+        max_start = np.iinfo(np.int64).max
+        result.starts = np.minimum(np.concatenate(([max_start], np.minimum.accumulate(self.starts[:-1]))),
+                                   np.concatenate((np.minimum.accumulate(self.starts[:0:-1])[::-1], [max_start])))
+        result.ends = np.maximum(np.concatenate(([-1], np.maximum.accumulate(self.ends[:-1]))),
+                                 np.concatenate((np.maximum.accumulate(self.ends[:0:-1])[::-1], [-1])))
+        if self.insertions:
+            # merged insertions of the rows before and after each row
+            before: List[Dict[int, np.array]] = [{}]
+            for i in range(n - 1):
+                before.append(merge_insertions(
+                    before[-1], self.insertions.get(i, {})))
+            after: List[Dict[int, np.array]] = [{}]
+            for i in range(n - 1, 0, -1):
+                after.append(merge_insertions(
+                    self.insertions.get(i, {}), after[-1]))
+            after.reverse()
+            for i in range(n):
+                insertions = merge_insertions(before[i], after[i])
+                if insertions:
+                    result.insertions[i] = insertions
+        return result
+
+    def _group_rows(self, groups: np.array, index: Optional[np.array]) -> Iterator[Tuple[int, np.array]]:
+        """
+        Yields the group numbers with their rows in the order of combine
+        """
+        order = np.argsort(groups, kind='stable')
+        order = order[groups[order] >= 0]
+        boundaries = np.flatnonzero(np.diff(groups[order])) + 1
+        for i, rows in enumerate(np.split(order, boundaries) if len(order) else []):
+            if index is not None:
+                rows = index[rows]
+                # combining a row again doesn't change the result
+                _, first = np.unique(rows, return_index=True)
+                rows = rows[np.sort(first)]
+            yield i, rows
+
+    def combine(self, groups: np.array, n_groups: int, index: Optional[np.array] = None, block_rows: int = 4096) -> 'SequenceMatrix':
+        """
+        Combines the rows with the same group number.
+
+        groups contains the group number in range(n_groups) for each row or -1 for rows outside of all groups.
+        Every group should contain at least one row.
+
+        If index is given, groups[i] is the group of the row index[i], which allows rows to occur several times.
+
+        If the matrix is memory-mapped, it is read once in blocks of block_rows rows, see _combine_blocks.
+        """
+        if isinstance(self.data, np.memmap):
+            return self._combine_blocks(groups, n_groups, index, block_rows)
+        result = SequenceMatrix.empty(n_groups, self.width, self.packed)
+        for i, rows in self._group_rows(groups, index):
+            result.data[i], result.starts[i], result.ends[i], insertions = self._union(
+                rows)
+            if insertions:
+                result.insertions[i] = insertions
+        return result
+
+    def _combine_blocks(self, groups: np.array, n_groups: int, index: Optional[np.array], block_rows: int) -> 'SequenceMatrix':
+        """
+        Same as combine, but reads the matrix in a single pass over blocks of block_rows rows.
+
+        Only a block and the combined rows are held in memory at once.
+        """
+        assert(np.issubdtype(groups.dtype, np.integer))
+        rows = index if index is not None else np.arange(len(groups))
+        selected = groups >= 0
+        # distinct (row, group) pairs, sorted by row
+        pairs = np.unique(np.stack(
+            (rows[selected], groups[selected]), axis=1).reshape(-1, 2), axis=0)
+        result = SequenceMatrix.empty(n_groups, self.width, self.packed)
+        result.starts[:] = np.iinfo(np.int64).max
+        result.ends[:] = -1
+        for k in range(0, len(self), block_rows):
+            lo, hi = np.searchsorted(pairs[:, 0], [k, k + block_rows])
+            if lo == hi:
+                continue
+            pair_rows = pairs[lo:hi, 0]
+            pair_groups = pairs[lo:hi, 1]
+            block = np.asarray(self.data[k:k + block_rows])
+            np.bitwise_or.at(result.data, pair_groups, block[pair_rows - k])
+            np.minimum.at(result.starts, pair_groups,
+                          np.asarray(self.starts[pair_rows]))
+            np.maximum.at(result.ends, pair_groups,
+                          np.asarray(self.ends[pair_rows]))
+        empty = result.ends < 0
+        result.starts[empty] = 0
+        result.ends[empty] = 0
+        if self.insertions:
+            for i, group_rows in self._group_rows(groups, index):
+                insertions = self._union_insertions(group_rows)
+                if insertions:
+                    result.insertions[i] = insertions
+        return result
+
+
+def _zeros(shape: Tuple[int, ...], dtype: type, directory: Optional[str] = None) -> np.array:
+    """
+    Returns an array of zeros, which is a memory-mapped temporary file in directory, if it's given.
+
+    The file is deleted, when the array is no longer used
+    """
+    if directory is None or not np.prod(shape, dtype=np.int64):
+        return np.zeros(shape, dtype=dtype)
+    with tempfile.TemporaryFile(dir=directory) as file:
+        return np.memmap(file, dtype=dtype, mode='w+', shape=shape)
+
+
+# alignment function of a worker process of align_sequences, set by _init_worker
+_worker_align: Optional[Callable[[np.array], np.array]] = None
+
+
+def _alignment_function(ref_data: np.array, fast: bool, config: Optional[Config]) -> Callable[[np.array], np.array]:
+    """
+    Returns the function that computes the alignment coordinates of data with ref_data
+    """
+    if fast:
+        return FastAligner(ref_data, config=config).align_coordinates
+    else:
+        return lambda data: align_coordinates(data, ref_data, config)
+
+
+def _init_worker(ref_data: np.array, fast: bool, config: Optional[Config]) -> None:
+    global _worker_align
+    _worker_align = _alignment_function(ref_data, fast, config)
+
+
+def _align_chunk(chunk: Tuple[np.array, np.array]) -> List[np.array]:
+    """
+    Aligns a chunk of sequences in a worker process.
+
+    The chunk consists of the concatenated sequences and their lengths
+    """
+    assert(_worker_align is not None)
+    data, lengths = chunk
+    return [_worker_align(seq_data) for seq_data in np.split(data, np.cumsum(lengths)[:-1])]
+
+
+class AlignmentDisplays(Sequence[str]):
+    """
+    Displays of the alignments of sequences with a reference, which are rendered only when accessed
+
+    Only the alignment coordinates are kept, displays that are already known can be given in rendered.
+    """
+
+    def __init__(self, sequences: Sequence[np.array], ref_data: np.array, coordinates: Sequence[np.array], rendered: Optional[Dict[int, str]] = None) -> None:
+        self.sequences = sequences
+        self.ref_data = ref_data
+        self.coordinates = coordinates
+        self.rendered = rendered or {}
+
+    def __len__(self) -> int:
+        return len(self.coordinates)
+
+    def __getitem__(self, i: int) -> str:  # type: ignore[override]
+        try:
+            return self.rendered[i]
+        except KeyError:
+            return format_alignment(self.sequences[i], self.ref_data, self.coordinates[i])
+
+
+class ReferenceAlignment:
+    """
+    Alignment of sequences with a named reference: the matrix of the aligned sequences and the displays of the alignments
+
+    method is "fast" or "exact", see align_sequences, and config contains the scores of the alignment
+    """
+
+    def __init__(self, reference_name: str, method: str, matrix: SequenceMatrix, displays: AlignmentDisplays, config: Optional[Config] = None) -> None:
+        self.reference_name = reference_name
+        self.method = method
+        self.matrix = matrix
+        self.displays = displays
+        self.config = config
+
+    @property
+    def reference_key(self) -> bytes:
+        """
+        Key of the reference, the scores and the method, see AlignmentCache.reference_key
+        """
+        return AlignmentCache.reference_key(self.reference_name, self.displays.ref_data, self.method, self.config)
+
+
+class SequenceDisplays(Sequence[str]):
+    """
+    Displays of the rows of a matrix of sequences that are already aligned, which are rendered only when accessed
+    """
+
+    def __init__(self, matrix: SequenceMatrix) -> None:
+        self.matrix = matrix
+
+    def __len__(self) -> int:
+        return len(self.matrix)
+
+    def __getitem__(self, i: int) -> str:  # type: ignore[override]
+        return str(self.matrix.row(i))
+
+
+def align_sequences(sequences: Sequence[np.array], ref: Seq, packed: bool = False, workers: int = 1, chunk_size: int = 16,
+                    cache: Optional[AlignmentCache] = None, reference_name: str = "", fast: bool = False, directory: Optional[str] = None,
+                    progress: Optional[Callable[[int, int], None]] = None, config: Optional[Config] = None) -> Tuple[SequenceMatrix, AlignmentDisplays]:
+    """
+    Aligns the encoded sequences with ref.
+
+    Returns the matrix of aligned sequences and the displays of the alignments
+
+    If workers > 1, the sequences are aligned in a pool of worker processes.
+    Each worker receives the reference once and the sequences in chunks of chunk_size concatenated sequences.
+    The chunks are small, so that the progress is reported often and a cancellation only waits for the running chunks.
+    The result is the same as with workers == 1, which aligns in the current process.
+
+    If cache is given, only the sequences missing from it are aligned and then added to it.
+
+    If fast is set, the sequences are aligned with FastAligner.
+
+    If directory is given, the matrix is stored in memory-mapped temporary files in it.
+
+    progress is called with the number of aligned sequences and the number of sequences to align.
+    If it raises an exception, the pending alignments are cancelled.
+
+    The sequences are aligned with the aligner of config or default_config(), the workers receive config and build their own aligner.
+    """
+    coordinates: List[Optional[np.array]] = [None] * len(sequences)
+    rendered: Dict[int, str] = {}
+    if cache is not None:
+        reference_key = AlignmentCache.reference_key(
+            reference_name, ref.data, "fast" if fast else "exact", config)
+        keys = [AlignmentCache.key(reference_key, data) for data in sequences]
+        cached = cache.get(keys)
+        for i, key in enumerate(keys):
+            if key in cached:
+                coordinates[i], display = cached[key]
+                if display is not None:
+                    rendered[i] = display
+    missing = [i for i, result in enumerate(coordinates) if result is None]
+    if progress is not None:
+        progress(0, len(missing))
+    if workers <= 1 or len(missing) <= chunk_size:
+        align = _alignment_function(ref.data, fast, config)
+        for done, i in enumerate(missing, start=1):
+            coordinates[i] = align(sequences[i])
+            if progress is not None:
+                progress(done, len(missing))
+    else:
+        chunks = ((k, (np.concatenate([sequences[i] for i in missing[k:k + chunk_size]]),
+                       np.array([len(sequences[i]) for i in missing[k:k + chunk_size]])))
+                  for k in range(0, len(missing), chunk_size))
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(ref.data, fast, config))
+        try:
+            futures = {executor.submit(_align_chunk, chunk): k for k, chunk in chunks}
+            done = 0
+            for future in as_completed(futures):
+                k = futures[future]
+                chunk_results = future.result()
+                for i, result in zip(missing[k:k + chunk_size], chunk_results):
+                    coordinates[i] = result
+                done += len(chunk_results)
+                if progress is not None:
+                    progress(done, len(missing))
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        else:
+            executor.shutdown()
+    all_coordinates = cast(List[np.array], coordinates)
+    displays = AlignmentDisplays(sequences, ref.data, all_coordinates, rendered)
+    if cache is not None:
+        cache.put((keys[i], all_coordinates[i], displays[i] if cache.store_displays else None)
+                  for i in missing)
+
+    matrix = SequenceMatrix.empty(
+        len(sequences), len(ref.data), packed, directory)
+    for i, data in enumerate(sequences):
+        matrix.set_row(i, *apply_alignment(data, ref.data, all_coordinates[i]))
+    return matrix, displays